@@ -0,0 +1,121 @@
+# batcher.py
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+
+
+class EmbeddingBatcher:
+    """ micro-batching scheduler: concurrent requests queue their face crops and
+    a single worker groups them into batches, each embedded with one forward pass.
+    Up to max_in_flight batches run at once, one per model worker process. """
+
+    def __init__(self, runner, max_batch_size: int = None, max_wait_ms: float = None, input_size: int = 160,
+                 max_in_flight: int = 1):
+        # runner takes a list of face crops and returns one embedding per crop
+        self.runner = runner
+        # crops from different requests must share a shape to be stacked into one batch
+        self.input_size = input_size
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBED_BATCH_SIZE", "16"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+
+        # a batch is only collected once a slot is free, so crops keep piling up while every model is busy
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-batch")
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._batch_sizes = {}
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, img) -> Future:
+        """ queue one face crop, the returned future resolves to its embedding """
+        self.start()
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    async def embed(self, img):
+        """ awaitable version of submit for async endpoints """
+        return await asyncio.wrap_future(self.submit(img))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # drop requests whose caller already gave up
+        return [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+
+    def _worker(self):
+        while True:
+            self._slots.acquire()
+            batch = self._collect()
+            if batch:
+                self._pool.submit(self._run_slot, batch)
+            else:
+                self._slots.release()
+
+    def _run_slot(self, batch):
+        try:
+            self._run(batch)
+        finally:
+            self._slots.release()
+
+    def _resize(self, img):
+        if img.shape[:2] != (self.input_size, self.input_size):
+            img = cv2.resize(img, (self.input_size, self.input_size))
+        return img
+
+    def _run(self, batch):
+        try:
+            vectors = self.runner([self._resize(img) for img, _ in batch])
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            size = len(batch)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._batches += 1
+            self._items += size
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_in_flight": self.max_in_flight,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            }
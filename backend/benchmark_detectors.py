@@ -0,0 +1,90 @@
+# benchmark_detectors.py
+# Compare face detector backends on labeled images, static/ with benchmark_labels.csv by default
+# python benchmark_detectors.py [--folder static] [--labels benchmark_labels.csv] [--detectors haar,dnn,mtcnn]
+#                               [--repeat 5] [--max-side 800]
+#
+# The labels file lists image,has_face (1 or 0) for the images of the folder; unlisted images are skipped.
+
+import argparse
+import csv
+import os
+import time
+
+import cv2
+
+from detector import DETECTORS, create_detector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_labels(path):
+    """ image name -> True when it shows a face """
+    with open(path, newline="") as f:
+        return {row["image"]: row["has_face"].strip() == "1" for row in csv.DictReader(f)}
+
+
+def load_images(folder, labels):
+    """ (name, image, has_face) of every labeled image in the folder """
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS) or name not in labels:
+            continue
+        img = cv2.imread(os.path.join(folder, name))
+        if img is not None:
+            images.append((name, img, labels[name]))
+    return images
+
+
+def benchmark(detector, images, repeat):
+    """ recall over the face images and false positives over the images without a face, so a detector
+    that boxes everything cannot look good """
+    hits = false_positives = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hits = false_positives = 0
+        for _, img, has_face in images:
+            found = bool(detector.detect(img))
+            if has_face:
+                hits += found
+            else:
+                false_positives += found
+    elapsed = time.perf_counter() - start
+    calls = len(images) * repeat
+    faces = sum(1 for _, _, has_face in images if has_face)
+    return {
+        "faces_per_sec": calls / elapsed if elapsed else 0.0,
+        "ms_per_image": elapsed / calls * 1000 if calls else 0.0,
+        "recall": hits / faces if faces else 0.0,
+        "false_positives": false_positives,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face detector benchmark")
+    parser.add_argument("--folder", default="static")
+    parser.add_argument("--labels", default="benchmark_labels.csv", help="image,has_face rows for the folder")
+    parser.add_argument("--detectors", default=",".join(DETECTORS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-side", type=int, default=None)
+    parser.add_argument("--scale-factor", type=float, default=1.3)
+    parser.add_argument("--min-size", type=int, default=None)
+    args = parser.parse_args()
+
+    images = load_images(args.folder, load_labels(args.labels))
+    faces = sum(1 for _, _, has_face in images if has_face)
+    print(f"{len(images)} labeled images from {args.folder}: {faces} with a face, {len(images) - faces} without")
+    print(f"{'detector':<10}{'faces/sec':>12}{'ms/image':>12}{'recall':>10}{'false pos':>12}")
+    for name in args.detectors.split(","):
+        try:
+            detector = create_detector(name, scale_factor=args.scale_factor,
+                                       min_size=args.min_size, max_side=args.max_side)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{name:<10}skipped: {e}")
+            continue
+        result = benchmark(detector, images, args.repeat)
+        print(f"{name:<10}{result['faces_per_sec']:>12.1f}{result['ms_per_image']:>12.2f}{result['recall']:>10.2f}"
+              f"{result['false_positives']:>6}/{len(images) - faces:<5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from vector_codec import decode_vector
+
+_MISSING = object()
+
+
+class LRUCache:
+    """ thread safe LRU cache with a size cap and an optional per-entry TTL """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """ the parts of a User row needed for verification, with the embedding already decoded """
+    id: int
+    email: str
+    fullname: Optional[str]
+    imageurl: Optional[str]
+    vector: Optional[np.ndarray]
+    centroid: Optional[np.ndarray] = None
+    radius: float = 0.0
+
+    @classmethod
+    def from_user(cls, user, centroid=None):
+        vector = decode_vector(user.vector) if user.vector is not None else None
+        if centroid is None:
+            return cls(id=user.id, email=user.email, fullname=user.fullname, imageurl=user.imageurl, vector=vector)
+        return cls(id=user.id, email=user.email, fullname=user.fullname, imageurl=user.imageurl, vector=vector,
+                   centroid=decode_vector(centroid.vector), radius=centroid.radius)
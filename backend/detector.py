@@ -0,0 +1,129 @@
+# detector.py
+
+import os
+
+import cv2
+
+
+class FaceDetector:
+    """ base class for face detectors: downscale large images, detect, map boxes back to the original size """
+
+    name = "base"
+
+    def __init__(self, scale_factor: float = 1.3, min_size: int = None, max_side: int = None):
+        self.scale_factor = scale_factor
+        # min_size is in pixels of the original image
+        self.min_size = min_size if min_size is not None else int(os.getenv("FACE_MIN_SIZE", "0"))
+        self.max_side = max_side if max_side is not None else int(os.getenv("FACE_DETECT_MAX_SIDE", "800"))
+
+    def detect(self, img):
+        """ return a list of (x1, y1, x2, y2) boxes in the coordinates of img """
+        height, width = img.shape[:2]
+        scale = 1.0
+        if self.max_side and max(height, width) > self.max_side:
+            scale = self.max_side / max(height, width)
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        boxes = []
+        for (x, y, w, h) in self._detect(img, int(self.min_size * scale)):
+            x1 = max(0, int(x / scale))
+            y1 = max(0, int(y / scale))
+            x2 = min(width, int((x + w) / scale))
+            y2 = min(height, int((y + h) / scale))
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2, y2))
+        return boxes
+
+    def _detect(self, img, min_size: int):
+        """ return (x, y, w, h) boxes for the (possibly downscaled) BGR image """
+        raise NotImplementedError
+
+
+class HaarDetector(FaceDetector):
+    name = "haar"
+
+    def __init__(self, cascade_path: str = "haarcascade_frontalface_default.xml", min_neighbors: int = 5, **kwargs):
+        super().__init__(**kwargs)
+        self.min_neighbors = min_neighbors
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise FileNotFoundError(f"Could not load Haar cascade from {cascade_path}")
+
+    def _detect(self, img, min_size):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors,
+                                              minSize=(min_size, min_size))
+        return [tuple(face) for face in faces]
+
+
+class DnnDetector(FaceDetector):
+    """ OpenCV DNN res10 SSD face detector, model files are not bundled with the repo """
+
+    name = "dnn"
+
+    def __init__(self, prototxt: str = None, model: str = None, confidence: float = None,
+                 input_size: int = 300, **kwargs):
+        super().__init__(**kwargs)
+        prototxt = prototxt or os.getenv("FACE_DNN_PROTOTXT", "deploy.prototxt")
+        model = model or os.getenv("FACE_DNN_MODEL", "res10_300x300_ssd_iter_140000.caffemodel")
+        for path in (prototxt, model):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"DNN face detector file not found: {path}")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.confidence = confidence if confidence is not None else float(os.getenv("FACE_DNN_CONFIDENCE", "0.6"))
+        self.input_size = input_size
+
+    def _detect(self, img, min_size):
+        height, width = img.shape[:2]
+        blob = cv2.dnn.blobFromImage(img, 1.0, (self.input_size, self.input_size), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+
+        faces = []
+        for det in detections:
+            if det[2] < self.confidence:
+                continue
+            x1, y1 = int(det[3] * width), int(det[4] * height)
+            x2, y2 = int(det[5] * width), int(det[6] * height)
+            w, h = x2 - x1, y2 - y1
+            if w >= min_size and h >= min_size and w > 0 and h > 0:
+                faces.append((x1, y1, w, h))
+        return faces
+
+
+class MtcnnDetector(FaceDetector):
+    name = "mtcnn"
+
+    def __init__(self, confidence: float = 0.9, **kwargs):
+        super().__init__(**kwargs)
+        from mtcnn import MTCNN
+
+        # MTCNN builds its image pyramid with a shrink factor below 1
+        self.mtcnn = MTCNN(min_face_size=max(self.min_size, 20), scale_factor=min(1 / self.scale_factor, 0.9))
+        self.confidence = confidence
+
+    def _detect(self, img, min_size):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        faces = []
+        for face in self.mtcnn.detect_faces(rgb):
+            x, y, w, h = face["box"]
+            if face["confidence"] >= self.confidence and w >= min_size and h >= min_size:
+                faces.append((x, y, w, h))
+        return faces
+
+
+DETECTORS = {
+    HaarDetector.name: HaarDetector,
+    DnnDetector.name: DnnDetector,
+    MtcnnDetector.name: MtcnnDetector,
+}
+
+
+def create_detector(name: str = None, **kwargs) -> FaceDetector:
+    """ build the detector selected by FACE_DETECTOR (haar, dnn or mtcnn) """
+    name = name or os.getenv("FACE_DETECTOR", "haar")
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown face detector: {name}")
+    if "scale_factor" not in kwargs and os.getenv("FACE_SCALE_FACTOR"):
+        kwargs["scale_factor"] = float(os.getenv("FACE_SCALE_FACTOR"))
+    return DETECTORS[name](**kwargs)
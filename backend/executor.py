@@ -0,0 +1,92 @@
+# executor.py
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import HTTPException
+
+_worker_model = None
+
+
+def _init_model_worker():
+    """ load the facenet model once per worker process """
+    global _worker_model
+    from facenet_runtime import create_facenet
+    _worker_model = create_facenet()
+
+
+def _embed_in_worker(imgs):
+    return _worker_model.embeddings(imgs)
+
+
+class ProcessPoolModel:
+    """ stands in for FaceNet in the server process when INFERENCE_MODEL_POOL is "process":
+    embeddings() runs on worker processes that each load their own model, the server process loads none """
+
+    def __init__(self, workers: int = None):
+        workers = workers or int(os.getenv("INFERENCE_MODEL_WORKERS", "1"))
+        # spawn rather than fork: forking a process that already started tensorflow threads can deadlock
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_model_worker)
+
+    def embeddings(self, imgs):
+        return self._pool.submit(_embed_in_worker, list(imgs)).result()
+
+
+class InferenceExecutor:
+    """ runs CPU heavy face work off the event loop with a bounded number of requests in flight """
+
+    def __init__(self, runner=None, cv_workers: int = None, max_queue: int = None, model_pool: str = None):
+        # runner embeds a list of crops; with the process pool it reaches the workers through ProcessPoolModel
+        self.runner = runner
+        self.max_queue = max_queue or int(os.getenv("INFERENCE_MAX_QUEUE", "64"))
+        self.model_pool = model_pool or os.getenv("INFERENCE_MODEL_POOL", "thread")
+        if self.model_pool not in ("thread", "process"):
+            raise ValueError(f"Unknown INFERENCE_MODEL_POOL: {self.model_pool}")
+        # batches the model can run at once: one per worker process, an in-process model takes one at a time
+        self.model_workers = int(os.getenv("INFERENCE_MODEL_WORKERS", "1")) if self.model_pool == "process" else 1
+
+        cv_workers = cv_workers or int(os.getenv("INFERENCE_CV_WORKERS", str(os.cpu_count() or 1)))
+        self._cv_pool = ThreadPoolExecutor(max_workers=cv_workers, thread_name_prefix="inference-cv")
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """ reserve a place in the inference queue, fail fast with 503 when it is full """
+        with self._lock:
+            if self._in_flight >= self.max_queue:
+                self._rejected += 1
+                raise HTTPException(status_code=503, detail="Face verification is busy, try again")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """ run a blocking OpenCV call on the thread pool """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._cv_pool, partial(fn, *args, **kwargs))
+
+    def embed(self, imgs):
+        """ blocking batch embedding """
+        return self.runner(imgs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_queue": self.max_queue,
+                "rejected": self._rejected,
+                "model_pool": self.model_pool,
+                "model_workers": self.model_workers,
+            }
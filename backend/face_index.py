@@ -0,0 +1,140 @@
+# face_index.py
+
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from vector_codec import load_all_vectors
+
+
+class FaceIndex:
+    """ in-memory matrix of all enrolled embeddings for 1:N identification """
+
+    def __init__(self, dim: int = 512, capacity: int = 1024, ttl: float = None):
+        self.dim = dim
+        # other workers enroll users too, so the index is rebuilt from the database after ttl seconds
+        self.ttl = ttl if ttl is not None else float(os.getenv("FACE_INDEX_TTL", "60"))
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+        self._refreshing = False
+        self.loaded = False
+
+    def __len__(self):
+        return self._size
+
+    def load(self, db: Session):
+        """ build the index from the users table in one query """
+        ids, matrix = load_all_vectors(db)
+        with self._lock:
+            n = len(ids)
+            self._rows = {int(user_id): row for row, user_id in enumerate(ids)}
+            self._size = 0
+            self._reserve(n)
+            if n:
+                self._matrix[:n] = matrix
+                self._sq_norms[:n] = np.einsum("ij,ij->i", matrix, matrix)
+                self._ids[:n] = ids
+            self._size = n
+            self.loaded = True
+            self._loaded_at = time.monotonic()
+
+    def stale(self) -> bool:
+        return not self.loaded or bool(self.ttl) and time.monotonic() - self._loaded_at > self.ttl
+
+    def ensure_loaded(self, db: Session):
+        if self.stale():
+            with self._lock:
+                if self.stale():
+                    self.load(db)
+
+    def refresh_in_background(self, session_factory) -> bool:
+        """ rebuild a stale index on its own thread and session while searches keep using the current rows.
+        Returns False when a refresh is already running. """
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+
+        def refresh():
+            db = session_factory()
+            try:
+                self.load(db)
+            except Exception as e:
+                print(f"Face index refresh failed: {e}")
+            finally:
+                db.close()
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="face-index-refresh", daemon=True).start()
+        return True
+
+    def add(self, user_id: int, vector):
+        """ insert or replace the embedding of a user """
+        with self._lock:
+            self._reserve(self._size + 1)
+            self._put(user_id, vector)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                # move the last row into the hole to keep the matrix contiguous
+                self._matrix[row] = self._matrix[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._size = last
+
+    def search(self, probe, k: int = 5):
+        """ return up to k (user_id, distance) pairs closest to the probe embedding """
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            matrix = self._matrix[:n]
+            # ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab, one matrix-vector product for all rows
+            sq_dist = self._sq_norms[:n] - 2 * (matrix @ probe) + probe @ probe
+            ids = self._ids[:n].copy()
+
+        np.maximum(sq_dist, 0, out=sq_dist)
+        k = min(k, n)
+        top = np.argpartition(sq_dist, k - 1)[:k]
+        top = top[np.argsort(sq_dist[top])]
+        return [(int(ids[i]), float(np.sqrt(sq_dist[i]))) for i in top]
+
+    def _reserve(self, size: int):
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._sq_norms, self._ids = matrix, sq_norms, ids
+
+    def _put(self, user_id: int, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._size
+            self._rows[user_id] = row
+            self._ids[row] = user_id
+            self._size += 1
+        self._matrix[row] = vector
+        self._sq_norms[row] = vector @ vector
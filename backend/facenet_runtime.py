@@ -0,0 +1,125 @@
+# facenet_runtime.py
+# FaceNet backends with the keras_facenet FaceNet.embeddings() interface.
+# tflite and onnx run a model exported by facenet_tools.py without loading keras.
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+INPUT_SIZE = 160
+
+
+def prepare_faces(images) -> np.ndarray:
+    """ same preprocessing as keras_facenet: resize to 160x160 and scale pixels to [-1, 1] """
+    batch = np.empty((len(images), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+    for i, img in enumerate(images):
+        if img.shape[:2] != (INPUT_SIZE, INPUT_SIZE):
+            img = cv2.resize(img, (INPUT_SIZE, INPUT_SIZE))
+        batch[i] = img
+    batch -= 127.5
+    batch /= 127.5
+    return batch
+
+
+def l2_normalize(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-10)
+
+
+def _tflite_interpreter(model_path, num_threads):
+    """ the standalone runtimes are a few MB, full tensorflow is only the last resort """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+class TFLiteFaceNet:
+    """ float32, float16 or int8 quantized TFLite export of the FaceNet model """
+
+    name = "tflite"
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        self.interpreter = _tflite_interpreter(model_path, num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input["shape"][0])
+        # an interpreter holds its tensors, so calls from several executor threads take turns
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch):
+        if self.input["dtype"] == np.float32:
+            return batch
+        scale, zero_point = self.input["quantization"]
+        info = np.iinfo(self.input["dtype"])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(self.input["dtype"])
+
+    def _dequantize(self, output):
+        if self.output["dtype"] == np.float32:
+            return output
+        scale, zero_point = self.output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def embeddings(self, images):
+        batch = self._quantize(prepare_faces(images))
+        with self._lock:
+            if batch.shape[0] != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output["index"])
+        return l2_normalize(self._dequantize(output))
+
+
+class OnnxFaceNet:
+    """ ONNX export of the FaceNet model on the onnxruntime CPU provider """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embeddings(self, images):
+        output = self.session.run(None, {self.input_name: prepare_faces(images)})[0]
+        return l2_normalize(output)
+
+
+FACENET_BACKENDS = {
+    TFLiteFaceNet.name: TFLiteFaceNet,
+    OnnxFaceNet.name: OnnxFaceNet,
+}
+
+
+def create_facenet(name: str = None, model_path: str = None, num_threads: int = None):
+    """ build the backend named by FACENET_BACKEND (keras, tflite or onnx), reading FACENET_MODEL_PATH
+    for exported models """
+    name = name or os.getenv("FACENET_BACKEND", "keras")
+    if name == "keras":
+        from keras_facenet import FaceNet
+        return FaceNet()
+    if name not in FACENET_BACKENDS:
+        raise ValueError(f"Unknown FaceNet backend {name}, expected keras or one of {', '.join(FACENET_BACKENDS)}")
+
+    model_path = model_path or os.getenv("FACENET_MODEL_PATH")
+    if not model_path:
+        raise ValueError(f"FACENET_MODEL_PATH must point to the exported {name} model")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Could not find FaceNet model at {model_path}")
+    num_threads = num_threads or int(os.getenv("FACENET_THREADS", "0")) or None
+    return FACENET_BACKENDS[name](model_path, num_threads=num_threads)
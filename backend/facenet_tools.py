@@ -0,0 +1,214 @@
+# facenet_tools.py
+# Export FaceNet for the tflite / onnx backends, compare an export against the keras reference and
+# calibrate VERIFY_THRESHOLD from labeled faces.
+#
+# python facenet_tools.py export --format tflite --quantize float16 --output facenet_fp16.tflite
+# python facenet_tools.py export --format tflite --quantize int8 --output facenet_int8.tflite
+# python facenet_tools.py export --format onnx [--quantize dynamic] --output facenet.onnx
+# python facenet_tools.py check --backend tflite --model facenet_int8.tflite [--folder static]
+# python facenet_tools.py calibrate --folder people [--backend tflite --model facenet_int8.tflite] [--far 0.001]
+#   people/ holds one subfolder of images per person
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from detector import create_detector
+from facenet_runtime import create_facenet, prepare_faces
+from verification import VERIFY_THRESHOLD, calibrate_threshold
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+QUANTIZATIONS = {
+    "tflite": ("none", "dynamic", "float16", "int8"),
+    "onnx": ("none", "dynamic"),
+}
+DEFAULT_QUANTIZATION = {"tflite": "float16", "onnx": "none"}
+
+
+def load_faces(folder, limit=None):
+    """ 160x160 face crops of every image in the folder, cut the same way as Preprocess.getFace """
+    detector = create_detector()
+    faces = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        img = cv2.imread(os.path.join(folder, name))
+        if img is None:
+            continue
+        for (x1, y1, x2, y2) in detector.detect(img):
+            faces.append(cv2.resize(img[y1:y2, x1:x2], (160, 160)))
+        if limit and len(faces) >= limit:
+            break
+    return faces[:limit] if limit else faces
+
+
+def export_tflite(model, output, quantize, faces):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        if not faces:
+            raise ValueError("int8 quantization needs face images for calibration, check --folder")
+        # activations are calibrated on real crops; input and output stay float32
+        converter.representative_dataset = lambda: ([prepare_faces([face])] for face in faces)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output, quantize):
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = (tf.TensorSpec((None, 160, 160, 3), tf.float32, name="input"),)
+    target = output + ".float32" if quantize == "dynamic" else output
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=target)
+    if quantize == "dynamic":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(target, output, weight_type=QuantType.QInt8)
+        os.remove(target)
+
+
+def embed_timed(model, faces, batch_size):
+    """ embeddings of all faces and the average milliseconds per face """
+    model.embeddings(faces[:1])
+    started = time.perf_counter()
+    embeddings = np.concatenate([np.asarray(model.embeddings(faces[i:i + batch_size]), dtype=np.float32)
+                                 for i in range(0, len(faces), batch_size)])
+    return embeddings, (time.perf_counter() - started) / len(faces) * 1000
+
+
+def pair_distances(embeddings):
+    i, j = np.triu_indices(len(embeddings), k=1)
+    return np.linalg.norm(embeddings[i] - embeddings[j], axis=1)
+
+
+def load_labeled_faces(folder, limit=None):
+    """ face crops and person labels from one subfolder per person """
+    faces, labels = [], []
+    for person in sorted(os.listdir(folder)):
+        path = os.path.join(folder, person)
+        if not os.path.isdir(path):
+            continue
+        person_faces = load_faces(path, limit)
+        faces += person_faces
+        labels += [person] * len(person_faces)
+    return faces, np.asarray(labels)
+
+
+def genuine_impostor(embeddings, labels):
+    """ distances of every same person and every different person pair """
+    i, j = np.triu_indices(len(embeddings), k=1)
+    distances = np.linalg.norm(embeddings[i] - embeddings[j], axis=1)
+    same = labels[i] == labels[j]
+    return distances[same], distances[~same]
+
+
+def compare(reference, candidate, threshold):
+    """ per-face agreement of the two models and agreement of their same/different person decisions """
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = np.sum(reference * candidate, axis=1)
+    result = {
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "distance_max": float(np.linalg.norm(reference - candidate, axis=1).max()),
+    }
+    if len(reference) > 1:
+        ref_pairs, cand_pairs = pair_distances(reference), pair_distances(candidate)
+        result["pair_distance_max_diff"] = float(np.abs(ref_pairs - cand_pairs).max())
+        result["decision_agreement"] = float(np.mean((ref_pairs < threshold) == (cand_pairs < threshold)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FaceNet export, accuracy check and threshold calibration")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export")
+    export.add_argument("--format", choices=tuple(QUANTIZATIONS), default="tflite")
+    export.add_argument("--quantize", default=None, help="default float16 for tflite, none for onnx")
+    export.add_argument("--output", required=True)
+    export.add_argument("--folder", default="static", help="face images used to calibrate int8")
+    export.add_argument("--samples", type=int, default=200)
+
+    check = commands.add_parser("check")
+    check.add_argument("--backend", choices=("tflite", "onnx"), required=True)
+    check.add_argument("--model", required=True)
+    check.add_argument("--folder", default="static")
+    check.add_argument("--samples", type=int, default=None)
+    check.add_argument("--batch-size", type=int, default=16)
+    check.add_argument("--threshold", type=float, default=VERIFY_THRESHOLD)
+    check.add_argument("--min-cosine", type=float, default=0.99)
+
+    calibrate = commands.add_parser("calibrate")
+    calibrate.add_argument("--folder", required=True, help="one subfolder of face images per person")
+    calibrate.add_argument("--backend", default=None, help="default FACENET_BACKEND")
+    calibrate.add_argument("--model", default=None, help="default FACENET_MODEL_PATH")
+    calibrate.add_argument("--samples", type=int, default=None, help="faces per person")
+    calibrate.add_argument("--batch-size", type=int, default=16)
+    calibrate.add_argument("--far", type=float, default=None, help="target false accept rate, default equal error rate")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        faces, labels = load_labeled_faces(args.folder, args.samples)
+        if not faces:
+            sys.exit(f"No faces found in {args.folder}")
+        embeddings, _ = embed_timed(create_facenet(args.backend, args.model), faces, args.batch_size)
+        genuine, impostor = genuine_impostor(embeddings, labels)
+        if not len(genuine) or not len(impostor):
+            sys.exit(f"Need at least two people with two faces each in {args.folder}")
+        result = calibrate_threshold(genuine, impostor, args.far)
+        print(f"{len(faces)} faces of {len(set(labels))} people, {len(genuine)} genuine and {len(impostor)} impostor pairs")
+        print(f"genuine  mean {genuine.mean():.4f} max {genuine.max():.4f}")
+        print(f"impostor mean {impostor.mean():.4f} min {impostor.min():.4f}")
+        print(f"current {VERIFY_THRESHOLD:.4f}: far {np.mean(impostor < VERIFY_THRESHOLD):.4f} "
+              f"frr {np.mean(genuine >= VERIFY_THRESHOLD):.4f}")
+        print(f"chosen  {result['threshold']:.4f}: far {result['far']:.4f} frr {result['frr']:.4f}")
+        print(f"VERIFY_THRESHOLD={result['threshold']:.4f}")
+        return
+
+    if args.command == "export":
+        args.quantize = args.quantize or DEFAULT_QUANTIZATION[args.format]
+        if args.quantize not in QUANTIZATIONS[args.format]:
+            parser.error(f"{args.format} supports --quantize {', '.join(QUANTIZATIONS[args.format])}")
+
+    from keras_facenet import FaceNet
+    reference = FaceNet()
+
+    if args.command == "export":
+        if args.format == "tflite":
+            faces = load_faces(args.folder, args.samples) if args.quantize == "int8" else []
+            export_tflite(reference.model, args.output, args.quantize, faces)
+        else:
+            export_onnx(reference.model, args.output, args.quantize)
+        print(f"{args.output}: {os.path.getsize(args.output) / 2 ** 20:.1f} MB")
+        return
+
+    faces = load_faces(args.folder, args.samples)
+    if not faces:
+        sys.exit(f"No faces found in {args.folder}")
+    candidate = create_facenet(args.backend, args.model)
+    ref_embeddings, ref_ms = embed_timed(reference, faces, args.batch_size)
+    cand_embeddings, cand_ms = embed_timed(candidate, faces, args.batch_size)
+    result = compare(ref_embeddings, cand_embeddings, args.threshold)
+
+    print(f"{len(faces)} faces from {args.folder}, model {os.path.getsize(args.model) / 2 ** 20:.1f} MB")
+    print(f"keras {ref_ms:.2f} ms/face, {args.backend} {cand_ms:.2f} ms/face ({ref_ms / cand_ms:.1f}x)")
+    for key, value in result.items():
+        print(f"{key:<24}{value:.4f}")
+    if result["cosine_min"] < args.min_cosine:
+        sys.exit(f"cosine_min below {args.min_cosine}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# gallery.py
+# Several enrolled embeddings per user, summarized by a centroid so most verifications need one comparison.
+#
+# For gallery embeddings g within radius r of the centroid c, the triangle inequality bounds every
+# |probe - g| to [|probe - c| - r, |probe - c| + r]. When that whole range is on one side of the
+# threshold the centroid alone gives the same answer as the closest gallery embedding would.
+
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.user import UserCentroid, UserEmbedding
+from vector_codec import decode_vector, encode_vector
+from verification import VERIFY_THRESHOLD
+
+GALLERY_SIZE = int(os.getenv("GALLERY_SIZE", "5"))
+
+_stats_lock = threading.Lock()
+_stats = {"centroid": 0, "gallery": 0}
+
+
+def compute_centroid(vectors):
+    """ L2-normalized mean of the vectors and the largest distance of a vector from it """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    centroid = matrix.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    if norm > 0:
+        centroid = centroid / norm
+    radius = float(np.linalg.norm(matrix - centroid, axis=1).max())
+    return centroid, radius
+
+
+def add_embedding(db: Session, user_id: int, vector, quality: float = 1.0, previous: bytes = None) -> UserCentroid:
+    """ add an enrollment to the user's gallery, evict the lowest quality (then oldest) of the older entries
+    beyond GALLERY_SIZE and refresh the centroid. The caller commits. """
+    rows = db.query(UserEmbedding).filter(UserEmbedding.user_id == user_id).all()
+    now = datetime.utcnow()
+    if not rows and previous is not None:
+        # keep the single embedding stored before galleries existed, ranked below any new enrollment
+        rows.append(UserEmbedding(user_id=user_id, vector=encode_vector(decode_vector(previous)), quality=0.0, created_at=now))
+    newest = UserEmbedding(user_id=user_id, vector=encode_vector(vector), quality=quality, created_at=now)
+    db.add_all(rows + [newest])
+    db.flush()
+
+    # the enrollment just made always stays, even when older entries scored higher
+    rows.sort(key=lambda row: (row.quality, row.id))
+    while rows and len(rows) >= GALLERY_SIZE:
+        db.delete(rows.pop(0))
+    rows.append(newest)
+
+    centroid, radius = compute_centroid([decode_vector(row.vector) for row in rows])
+    entry = db.get(UserCentroid, user_id)
+    if entry is None:
+        entry = UserCentroid(user_id=user_id)
+        db.add(entry)
+    entry.vector = encode_vector(centroid)
+    entry.radius = radius
+    entry.count = len(rows)
+    return entry
+
+
+async def load_gallery(db: AsyncSession, user_id: int):
+    result = await db.execute(select(UserEmbedding.vector).where(UserEmbedding.user_id == user_id))
+    return np.stack([decode_vector(blob) for blob in result.scalars()])
+
+
+def centroid_distance(centroid, radius: float, probe, threshold: float = None):
+    """ returns (distance to the centroid, True when only the gallery can decide) """
+    threshold = VERIFY_THRESHOLD if threshold is None else threshold
+    distance = float(np.linalg.norm(np.asarray(probe, dtype=np.float32) - centroid))
+    return distance, abs(distance - threshold) <= radius
+
+
+def gallery_distance(gallery, probe) -> float:
+    return float(np.linalg.norm(gallery - np.asarray(probe, dtype=np.float32), axis=1).min())
+
+
+def count_decision(kind: str):
+    with _stats_lock:
+        _stats[kind] += 1
+
+
+def gallery_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,124 @@
+# liveness.py
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# face crops are measured at a fixed size so the thresholds do not depend on the camera resolution
+MEASURE_SIZE = 128
+
+# 8-neighbour offsets for the local binary pattern texture score
+LBP_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+REJECT_REASONS = ("face_too_small", "too_dark", "too_bright", "overexposed", "blurry", "pose", "spoof")
+
+_stats_lock = threading.Lock()
+_stats = {"checked": 0, "passed": 0, **{reason: 0 for reason in REJECT_REASONS}}
+
+
+@dataclass(frozen=True)
+class FaceQuality:
+    reason: Optional[str]
+    score: float
+    size: int
+    sharpness: float
+    brightness: float
+    clipped: float
+    asymmetry: float
+    texture: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.reason is None
+
+
+def texture_score(gray) -> float:
+    """ normalized entropy of the LBP code histogram, in [0, 1].
+    Prints and screen replays lose micro texture and score lower than a live face. """
+    center = gray[1:-1, 1:-1]
+    height, width = gray.shape
+    codes = np.zeros(center.shape, dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(LBP_OFFSETS):
+        neighbour = gray[1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+        codes |= (neighbour >= center).astype(np.uint8) << bit
+    hist = np.bincount(codes.ravel(), minlength=256) / codes.size
+    hist = hist[hist > 0]
+    return float(-(hist * np.log2(hist)).sum() / 8)
+
+
+class QualityGate:
+    """ cheap checks on a detected face that reject probes not worth a FaceNet forward pass:
+    size, exposure, blur (variance of the Laplacian) and optional frontal pose (left/right symmetry) and
+    texture based spoof checks. Checks run cheapest first and stop at the first failure. """
+
+    def __init__(self, min_size: int = None, min_brightness: float = None, max_brightness: float = None,
+                 max_clipped: float = None, min_sharpness: float = None, max_asymmetry: float = None,
+                 min_texture: float = None):
+        self.min_size = min_size if min_size is not None else int(os.getenv("FACE_QUALITY_MIN_SIZE", "64"))
+        self.min_brightness = min_brightness if min_brightness is not None else float(os.getenv("FACE_MIN_BRIGHTNESS", "40"))
+        self.max_brightness = max_brightness if max_brightness is not None else float(os.getenv("FACE_MAX_BRIGHTNESS", "220"))
+        self.max_clipped = max_clipped if max_clipped is not None else float(os.getenv("FACE_MAX_CLIPPED", "0.4"))
+        self.min_sharpness = min_sharpness if min_sharpness is not None else float(os.getenv("FACE_MIN_SHARPNESS", "35"))
+        # left/right symmetry also rejects frontal faces lit from one side, so it is off (0) unless configured
+        self.max_asymmetry = max_asymmetry if max_asymmetry is not None else float(os.getenv("FACE_MAX_ASYMMETRY", "0"))
+        # 0 disables the texture check
+        self.min_texture = min_texture if min_texture is not None else float(os.getenv("FACE_SPOOF_MIN_TEXTURE", "0"))
+
+    def _score(self, size, sharpness, asymmetry) -> float:
+        """ 0..1 quality used to weight frames against each other, 1 is comfortably above every threshold """
+        parts = (
+            min(1.0, size / (2 * self.min_size)) if self.min_size else 1.0,
+            min(1.0, sharpness / (2 * self.min_sharpness)) if self.min_sharpness else 1.0,
+            max(0.0, 1 - asymmetry / self.max_asymmetry) if self.max_asymmetry else 1.0,
+        )
+        return float(np.prod(parts) ** (1 / len(parts)))
+
+    def check(self, img, box) -> FaceQuality:
+        """ measure the (x1, y1, x2, y2) face box of a BGR image """
+        x1, y1, x2, y2 = box
+        size = min(x2 - x1, y2 - y1)
+        gray = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, (MEASURE_SIZE, MEASURE_SIZE), interpolation=cv2.INTER_AREA)
+
+        brightness = float(gray.mean())
+        clipped = float(((gray <= 5) | (gray >= 250)).mean())
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        pixels = gray.astype(np.float32)
+        half = MEASURE_SIZE // 2
+        asymmetry = float(np.abs(pixels[:, :half] - pixels[:, ::-1][:, :half]).mean() / 255)
+
+        reason = None
+        texture = None
+        if size < self.min_size:
+            reason = "face_too_small"
+        elif brightness < self.min_brightness:
+            reason = "too_dark"
+        elif brightness > self.max_brightness:
+            reason = "too_bright"
+        elif clipped > self.max_clipped:
+            reason = "overexposed"
+        elif sharpness < self.min_sharpness:
+            reason = "blurry"
+        elif self.max_asymmetry and asymmetry > self.max_asymmetry:
+            reason = "pose"
+        elif self.min_texture:
+            texture = texture_score(gray)
+            if texture < self.min_texture:
+                reason = "spoof"
+
+        with _stats_lock:
+            _stats["checked"] += 1
+            _stats[reason or "passed"] += 1
+
+        return FaceQuality(reason=reason, score=self._score(size, sharpness, asymmetry), size=size,
+                           sharpness=sharpness, brightness=brightness, clipped=clipped,
+                           asymmetry=asymmetry, texture=texture)
+
+
+def quality_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -1,22 +1,27 @@
 # main.py
 # uvicorn main:app --reload
+import asyncio
+import csv
+import io
+import json
 import os
-import uuid
 from datetime import datetime
-from fastapi import FastAPI, Depends, File, UploadFile, Form, HTTPException, Request
+from fastapi import FastAPI, Depends, File, UploadFile, Form, HTTPException, Response, Query
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, MetaData
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, MetaData, insert, select
+from sqlalchemy.orm import relationship, Session, load_only, selectinload
 from typing import List, Optional
 from db import Base, engine, get_db
 from fastapi.middleware.cors import CORSMiddleware
-from routes.user import user_router
+from starlette.concurrency import run_in_threadpool
+from routes.user import user_router, models, run_permission_purge
 from dotenv import load_dotenv
-from fastapi.staticfiles import StaticFiles  # StaticFiles import edildi
 # In main.py
 from models.user import Permission
-from fastapi.staticfiles import StaticFiles
-from verify_token import verify_jwt_token
+from verify_token import require_token
+from uploads import save_image_upload, RequestSizeLimitMiddleware
+from storage import image_store, CachedStaticFiles
+from metrics import MetricsMiddleware, registry, CONTENT_TYPE
 
 
 load_dotenv()
@@ -60,6 +65,10 @@ users_table = Table(
 # Create the tables in the database
 Base.metadata.create_all(bind=engine)
 
+# create_all skips existing tables, so add indexes introduced after the table was created
+for index in Permission.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
 # Define the Pydantic models
 class ApartmentCreateItem(BaseModel):
     number: str
@@ -111,15 +120,53 @@ class PermissionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+APARTMENT_FIELDS = ("id", "number", "floor", "residents")
+RESIDENT_FIELDS = ("id", "user_id", "apartment_id", "url")
+
+def parse_fields(fields: Optional[str], allowed, default):
+    """ comma separated field projection, id is always included for the pagination cursor """
+    if not fields:
+        return list(default)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in selected:
+        selected.insert(0, "id")
+    return selected
+
+def set_next_cursor(response: Response, items, limit: int):
+    # keyset pagination: pass the header value back as after_id to get the next page
+    if len(items) == limit:
+        response.headers["X-Next-After-Id"] = str(items[-1].id)
+
 # Create a FastAPI instance
 app = FastAPI()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
 app.include_router(user_router)
 
 # Statik dosyalara hizmet vermek için StaticFiles middleware'i ekle
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+PERMISSION_PURGE_INTERVAL = float(os.getenv("PERMISSION_PURGE_INTERVAL", "3600"))
+
+async def purge_permissions_periodically():
+    while True:
+        await asyncio.sleep(PERMISSION_PURGE_INTERVAL)
+        try:
+            deleted = await run_in_threadpool(run_permission_purge)
+            print(f"Purged {deleted} expired permissions")
+        except Exception as e:
+            print(f"Permission purge failed: {e}")
+
+# Load and warm up the face model in the background once the server is up
+@app.on_event("startup")
+def start_model_loading():
+    models.start()
+
+@app.on_event("startup")
+async def start_permission_purge():
+    asyncio.create_task(purge_permissions_periodically())
 
 origins = ["*"]
 # CORS
@@ -130,22 +177,87 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# reject oversized bodies before multipart parsing writes them to disk
+app.add_middleware(RequestSizeLimitMiddleware)
+# per route latency and status counts, and the optional Server-Timing header
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+# SQLite allows a limited number of bound parameters per statement
+IN_CHUNK_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+
+def bulk_insert_apartments(db: Session, apartments: List[ApartmentCreateItem]) -> List[ApartmentResponse]:
+    """ insert apartments with set based duplicate detection, the caller commits or rolls back """
+    numbers = [apartment.number for apartment in apartments]
+    seen = set()
+    repeated = sorted({number for number in numbers if number in seen or seen.add(number)})
+    if repeated:
+        raise HTTPException(status_code=400, detail=f"Duplicate apartment numbers in request: {', '.join(repeated)}")
+
+    existing = []
+    for i in range(0, len(numbers), IN_CHUNK_SIZE):
+        chunk = numbers[i:i + IN_CHUNK_SIZE]
+        existing += db.scalars(select(Apartment.number).where(Apartment.number.in_(chunk))).all()
+    if existing:
+        raise HTTPException(status_code=400, detail=f"Apartments with numbers {', '.join(sorted(existing))} already exist")
+
+    if not apartments:
+        return []
+    rows = db.execute(
+        insert(Apartment).returning(Apartment.id, Apartment.number, Apartment.floor),
+        [{"number": apartment.number, "floor": apartment.floor} for apartment in apartments],
+    ).all()
+    return [ApartmentResponse(id=row.id, number=row.number, floor=row.floor) for row in rows]
+
+def parse_apartment_rows(upload: UploadFile):
+    """ yield apartments from a CSV (number,floor header) or NDJSON upload without reading it all at once """
+    text = io.TextIOWrapper(upload.file, encoding="utf-8", newline="")
+    is_ndjson = (upload.filename or "").endswith((".ndjson", ".jsonl")) or "ndjson" in (upload.content_type or "")
+    if is_ndjson:
+        rows = (json.loads(line) for line in text if line.strip())
+    else:
+        rows = csv.DictReader(text)
+    for row in rows:
+        yield ApartmentCreateItem(number=row["number"], floor=int(row["floor"]))
 
 # Endpoint to add multiple apartments
 @app.post("/apartments/", response_model=List[ApartmentResponse])
 def create_apartments(apartments: ApartmentCreate, db: Session = Depends(get_db)):
-    created_apartments = []
-    for apartment in apartments.apartments:
-        existing_apartment = db.query(Apartment).filter(Apartment.number == apartment.number).first()
-        if existing_apartment:
-            raise HTTPException(status_code=400, detail=f"Apartment with number {apartment.number} already exists")
-        
-        db_apartment = Apartment(number=apartment.number, floor=apartment.floor)
-        db.add(db_apartment)
+    try:
+        created_apartments = bulk_insert_apartments(db, apartments.apartments)
         db.commit()
-        db.refresh(db_apartment)
-        created_apartments.append(db_apartment)
-    return created_apartments
+        return created_apartments
+    except Exception:
+        db.rollback()
+        raise
+
+# Endpoint to import a large apartment list as a CSV or NDJSON file in a single transaction
+@app.post("/apartments/import")
+def import_apartments(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    created = 0
+    try:
+        chunk = []
+        for apartment in parse_apartment_rows(file):
+            chunk.append(apartment)
+            if len(chunk) == IMPORT_CHUNK_SIZE:
+                created += len(bulk_insert_apartments(db, chunk))
+                chunk = []
+        created += len(bulk_insert_apartments(db, chunk))
+        db.commit()
+        return {"created": created}
+    except HTTPException:
+        db.rollback()
+        raise
+    except (KeyError, ValueError) as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid import row: {e}")
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint to add multiple residents with optional image upload
 @app.post("/residents/", response_model=ResidentResponse)
@@ -158,17 +270,8 @@ async def create_resident_with_image(
     try:
         url = None
         if image:
-            # Generate a unique filename using uuid
-            file_extension = os.path.splitext(image.filename)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            filepath = os.path.join("static", unique_filename)
-            
-            # Save the image to a static directory
-            with open(filepath, "wb") as file:
-                file.write(image.file.read())
-
-            # Generate URL based on the saved path
-            url = f"/static/{unique_filename}"
+            # Stream the image into the content addressed store
+            url = await save_image_upload(image, image_store)
 
         # Create the resident with the generated URL if image is provided
         resident = Resident(user_id=user_id, apartment_id=apartment_id, url=url)
@@ -177,32 +280,62 @@ async def create_resident_with_image(
         db.refresh(resident)
 
         return resident
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 # Endpoint to get all residents
-@app.get("/residents/", response_model=List[ResidentResponse])
-def read_residents(db: Session = Depends(get_db)):
-    residents = db.query(Resident).all()
-    return residents
+@app.get("/residents/")
+def read_residents(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    selected = parse_fields(fields, RESIDENT_FIELDS, RESIDENT_FIELDS)
+    query = db.query(*[getattr(Resident, field) for field in selected])
+    if after_id is not None:
+        query = query.filter(Resident.id > after_id)
+    residents = query.order_by(Resident.id).limit(limit).all()
+    set_next_cursor(response, residents, limit)
+    return [resident._asdict() for resident in residents]
 
 @app.get("/apartments")
-async def get_apartments(request: Request, db: Session = Depends(get_db)):
+async def get_apartments(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    decoded_token: dict = Depends(require_token),
+    db: Session = Depends(get_db)
+):
     try:
-        decoded_token = verify_jwt_token(request.headers.get("authorization"))
-        if decoded_token is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        db_resident = db.query(Resident).filter(Resident.user_id == decoded_token["id"]).all()
-        
-        apartments = []
-        
-        for res in db_resident:
-            apart = db.query(Apartment).filter(Apartment.id == res.apartment_id).first()
-            apartments.append(apart)
-        
-        return apartments
-
+        selected = parse_fields(fields, APARTMENT_FIELDS, ("id", "number", "floor"))
+        columns = [field for field in selected if field != "residents"]
+
+        # one query for the apartments (plus one for residents if requested) instead of one per resident
+        resident_apartments = select(Resident.apartment_id).where(Resident.user_id == decoded_token["id"])
+        query = db.query(Apartment).filter(Apartment.id.in_(resident_apartments))
+        query = query.options(load_only(*[getattr(Apartment, field) for field in columns]))
+        if "residents" in selected:
+            query = query.options(selectinload(Apartment.residents))
+        if after_id is not None:
+            query = query.filter(Apartment.id > after_id)
+        apartments = query.order_by(Apartment.id).limit(limit).all()
+        set_next_cursor(response, apartments, limit)
+
+        result = []
+        for apartment in apartments:
+            item = {field: getattr(apartment, field) for field in columns}
+            if "residents" in selected:
+                item["residents"] = [ResidentResponse.model_validate(res).model_dump() for res in apartment.residents]
+            result.append(item)
+        return result
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
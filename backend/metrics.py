@@ -0,0 +1,234 @@
+# metrics.py
+# In-process metrics in the Prometheus text exposition format, served by /metrics in main.py.
+#
+# stage("decode") times one step of the face pipeline into face_stage_seconds; with SERVER_TIMING=1 the
+# steps of a request are also returned in a Server-Timing header.
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# (name, seconds) of the stages run for the current request, None outside a request
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        """ (suffix, label string, value) triples """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{self.name}{suffix}{labels} {_number(value)}" for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(("_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), cumulative))
+                samples.append(("_sum", _labels(self.labelnames, key), total))
+                samples.append(("_count", _labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """ reads its value at scrape time, for numbers the app already keeps (queue depth, stats() counters).
+    fn returns a number, or a dict of label value -> number when there is one label. """
+
+    def __init__(self, name, help, fn, type="gauge", labelname=None):
+        super().__init__(name, help, (labelname,) if labelname else ())
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if not self.labelnames:
+            return [("", "", value)]
+        return [("", _labels(self.labelnames, (label,)), v) for label, v in value.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # one broken callback should not hide every other metric
+                parts.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(parts) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_requests = Counter("http_requests_total", "HTTP requests by route, method and status",
+                        ("route", "method", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route",
+                         ("route", "method"))
+stage_latency = Histogram("face_stage_seconds", "Time spent in each step of the face pipeline",
+                          ("stage",))
+
+
+@contextmanager
+def stage(name: str):
+    """ time one pipeline step into face_stage_seconds and the request's Server-Timing header """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_latency.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings, total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def route_label(scope) -> str:
+    """ the route template rather than the raw path, so ids in urls do not create new series """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        # mounted apps such as /static
+        return scope.get("root_path") or "/"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording latency and status per route, and the Server-Timing header """
+
+    def __init__(self, app, server_timing: bool = None):
+        self.app = app
+        self.server_timing = SERVER_TIMING if server_timing is None else server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    value = server_timing(timings, time.perf_counter() - started)
+                    headers.append((b"server-timing", value.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = route_label(scope)
+            http_latency.observe(time.perf_counter() - started, route=route, method=scope["method"])
+            http_requests.inc(route=route, method=scope["method"], status=status)
@@ -0,0 +1,85 @@
+# model_manager.py
+
+import os
+import threading
+import time
+
+import numpy as np
+from fastapi import HTTPException
+
+from preprocess import Preprocess
+
+
+class ModelManager:
+    """ loads the face pipeline in the background so the server can bind before the model is warm """
+
+    def __init__(self, factory=None):
+        self.factory = factory or self._default_factory
+        self._prep = None
+        self._error = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.load_seconds = None
+
+    @staticmethod
+    def _default_factory():
+        address = os.getenv("MODEL_SERVER_ADDRESS")
+        if address:
+            # every worker shares the model held by model_server.py instead of loading its own copy
+            from model_server import RemoteModel
+            return Preprocess(model=RemoteModel(address))
+        if os.getenv("INFERENCE_MODEL_POOL", "thread") == "process":
+            # the model lives only in the pool workers, this process keeps the detector
+            from executor import ProcessPoolModel
+            return Preprocess(model=ProcessPoolModel())
+        return Preprocess()
+
+    def start(self):
+        """ begin loading and warming up the model on a background thread """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+                self._thread.start()
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            prep = self.factory()
+            # run one inference so the first real request does not pay for graph tracing
+            prep.embedding_batch([np.zeros((160, 160, 3), dtype=np.uint8)])
+            prep.getFace(np.zeros((160, 160, 3), dtype=np.uint8))
+            self._prep = prep
+            self.load_seconds = time.perf_counter() - started
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and self._prep is not None
+
+    def wait(self, timeout: float = None) -> Preprocess:
+        """ block until the model is loaded, for worker threads and scripts """
+        self.start()
+        self._ready.wait(timeout)
+        return self.get()
+
+    def get(self) -> Preprocess:
+        """ return the warm pipeline or fail fast with 503 while it is still loading """
+        self.start()
+        if self._prep is not None:
+            return self._prep
+        if self._error is not None:
+            raise HTTPException(status_code=503, detail=f"Face model failed to load: {self._error}")
+        raise HTTPException(status_code=503, detail="Face model is loading, try again")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "loading": self._thread is not None and not self._ready.is_set(),
+            "error": str(self._error) if self._error is not None else None,
+            "load_seconds": self.load_seconds,
+            "remote": bool(os.getenv("MODEL_SERVER_ADDRESS")),
+        }
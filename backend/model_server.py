@@ -0,0 +1,105 @@
+# model_server.py
+# One FaceNet process shared by every uvicorn worker over a local socket.
+#
+# python model_server.py                      -> listens on MODEL_SERVER_ADDRESS (default 127.0.0.1:6000)
+# MODEL_SERVER_ADDRESS=127.0.0.1:6000 uvicorn main:app --workers 4
+# both sides need the same MODEL_SERVER_AUTHKEY
+
+import os
+import threading
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from dotenv import load_dotenv
+
+DEFAULT_ADDRESS = "127.0.0.1:6000"
+
+
+def parse_address(address: str):
+    """ "host:port" for TCP, anything else is treated as a unix socket path """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _authkey():
+    """ connections exchange pickles, so an empty or guessable key would let anyone run code in the server """
+    key = os.getenv("MODEL_SERVER_AUTHKEY")
+    if not key:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY must be set to use the model server")
+    return key.encode("utf-8")
+
+
+class RemoteModel:
+    """ drop-in for FaceNet exposing embeddings(), backed by a model_server connection """
+
+    def __init__(self, address: str):
+        self.address = parse_address(address)
+        self.authkey = _authkey()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = Client(self.address, authkey=self.authkey)
+        return self._conn
+
+    def embeddings(self, images):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    conn = self._connect()
+                    conn.send([np.ascontiguousarray(image) for image in images])
+                    result = conn.recv()
+                    break
+                except (EOFError, OSError):
+                    # the server restarted, reconnect once
+                    self._conn = None
+                    if attempt:
+                        raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _serve_connection(conn, model, model_lock):
+    with conn:
+        while True:
+            try:
+                images = conn.recv()
+            except EOFError:
+                return
+            try:
+                with model_lock:
+                    result = np.asarray(model.embeddings(images), dtype=np.float32)
+            except Exception as e:
+                result = RuntimeError(str(e))
+            conn.send(result)
+
+
+def serve(address: str = None):
+    from facenet_runtime import create_facenet
+
+    address = address or os.getenv("MODEL_SERVER_ADDRESS", DEFAULT_ADDRESS)
+    # refuse to start before loading the model rather than listen without a key
+    authkey = _authkey()
+    model = create_facenet()
+    model.embeddings([np.zeros((160, 160, 3), dtype=np.uint8)])
+    model_lock = threading.Lock()
+
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        print(f"Model server listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # a client with a wrong key should not bring the server down
+                print(f"Rejected connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, model, model_lock), daemon=True).start()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    serve()
@@ -1,5 +1,5 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, DateTime, Float, Index
 from sqlalchemy.orm import relationship
 
 class User(Base):
@@ -14,6 +14,25 @@ class User(Base):
 
     granted_permissions = relationship("Permission", foreign_keys="Permission.user_id", back_populates="user")
 
+class UserEmbedding(Base):
+    """ one enrolled face embedding, a user keeps at most GALLERY_SIZE of them """
+    __tablename__ = "user_embeddings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    vector = Column(LargeBinary, nullable=False)
+    quality = Column(Float, nullable=False, default=1.0)
+    created_at = Column(DateTime, nullable=False)
+
+class UserCentroid(Base):
+    """ L2-normalized mean of a user's gallery and the largest gallery distance from it """
+    __tablename__ = "user_centroids"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    vector = Column(LargeBinary, nullable=False)
+    radius = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
 class Permission(Base):
     __tablename__ = "permissions"
 
@@ -28,3 +47,10 @@ class Permission(Base):
     assigned_by = relationship("Resident", back_populates="created_permissions")
     user = relationship("User", back_populates="granted_permissions")
     apartment = relationship("Apartment")
+
+    __table_args__ = (
+        # gate checks: is there a permission for this user and apartment covering time t
+        Index("ix_permissions_gate", "user_id", "apartment_id", "start_date", "end_date"),
+        # purging expired passes
+        Index("ix_permissions_end_date", "end_date"),
+    )
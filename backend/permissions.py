@@ -0,0 +1,124 @@
+# permissions.py
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from models.user import Permission
+
+
+def find_active_permission(db: Session, user_id: int, apartment_id: int, at: datetime) -> Optional[int]:
+    """ single query on ix_permissions_gate, returns the id of a permission covering at """
+    row = db.query(Permission.id).filter(
+        Permission.user_id == user_id,
+        Permission.apartment_id == apartment_id,
+        Permission.start_date <= at,
+        Permission.end_date >= at,
+    ).first()
+    return row.id if row else None
+
+
+def purge_expired_permissions(db: Session, retention: timedelta, now: datetime = None) -> int:
+    """ delete passes that ended more than retention ago, returns the number of rows removed """
+    cutoff = (now or datetime.utcnow()) - retention
+    deleted = db.query(Permission).filter(Permission.end_date < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class ActivePermissionCache:
+    """ in-memory intervals of every permission that has not ended yet, keyed by (user_id, apartment_id) """
+
+    def __init__(self, ttl: float = None):
+        # passes created or reassigned by other workers only show up here after the next reload
+        self.ttl = ttl if ttl is not None else float(os.getenv("PERMISSION_CACHE_TTL", "30"))
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._intervals = {}
+        self._keys = {}
+        self._refreshed_at = 0.0
+        self.loaded_at = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self, db: Session, now: datetime = None):
+        now = now or datetime.utcnow()
+        rows = db.query(Permission.id, Permission.user_id, Permission.apartment_id,
+                        Permission.start_date, Permission.end_date).filter(Permission.end_date >= now).all()
+        with self._lock:
+            self._intervals = {}
+            self._keys = {}
+            for row in rows:
+                self._put(row.id, row.user_id, row.apartment_id, row.start_date, row.end_date)
+            self.loaded_at = now
+            self._refreshed_at = time.monotonic()
+
+    def stale(self) -> bool:
+        return not self.loaded or bool(self.ttl) and time.monotonic() - self._refreshed_at > self.ttl
+
+    def ensure_loaded(self, db: Session):
+        if self.stale():
+            with self._reload_lock:
+                if self.stale():
+                    self.load(db)
+
+    def add(self, permission: Permission):
+        """ record a new or changed permission, call after the write is committed """
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(permission.id)
+            if permission.end_date >= self.loaded_at:
+                self._put(permission.id, permission.user_id, permission.apartment_id,
+                          permission.start_date, permission.end_date)
+
+    def lookup(self, user_id: int, apartment_id: int, at: datetime) -> Optional[int]:
+        with self._lock:
+            for permission_id, start, end in self._intervals.get((user_id, apartment_id), ()):
+                if start <= at <= end:
+                    return permission_id
+        return None
+
+    def covers(self, at: datetime) -> bool:
+        """ only permissions that had not ended at load time are held, so older instants go to the database """
+        return self.loaded and at >= self.loaded_at
+
+    def purge(self, now: datetime = None):
+        """ drop intervals that have ended """
+        now = now or datetime.utcnow()
+        with self._lock:
+            for key, intervals in list(self._intervals.items()):
+                for permission_id, _, end in intervals:
+                    if end < now:
+                        self._keys.pop(permission_id, None)
+                alive = [interval for interval in intervals if interval[2] >= now]
+                if alive:
+                    self._intervals[key] = alive
+                else:
+                    del self._intervals[key]
+            if self.loaded:
+                self.loaded_at = max(self.loaded_at, now)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _put(self, permission_id, user_id, apartment_id, start, end):
+        key = (user_id, apartment_id)
+        self._intervals.setdefault(key, []).append((permission_id, start, end))
+        self._keys[permission_id] = key
+
+    def _remove(self, permission_id):
+        key = self._keys.pop(permission_id, None)
+        if key is None:
+            return
+        intervals = [interval for interval in self._intervals[key] if interval[0] != permission_id]
+        if intervals:
+            self._intervals[key] = intervals
+        else:
+            del self._intervals[key]
@@ -1,11 +1,30 @@
+import os
+
 import cv2
 import numpy as np
-from keras_facenet import FaceNet
+
+from detector import create_detector
+from facenet_runtime import create_facenet
+from liveness import QualityGate
+
+
+def decode_image(contents):
+    """ decode uploaded image bytes into a BGR array """
+    np_array = np.frombuffer(contents, np.uint8)
+    return cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+
 
 class Preprocess:
-    def __init__(self):
-        self.model = FaceNet()
-        self.face_cascade = cv2.CascadeClassifier("haarcascade_frontalface_default.xml")        
+    def __init__(self, model=None, detector=None, quality=None):
+        if model is None:
+            # keras is imported lazily, so workers on a shared model server or an exported model never load it
+            model = create_facenet()
+        self.model = model
+        self.detector = detector or create_detector()
+        # opt-in until the thresholds are tuned on images from the real cameras
+        if quality is None and os.getenv("FACE_QUALITY_CHECK", "0") == "1":
+            quality = QualityGate()
+        self.quality = quality
 
     def embedding(self,img):
         """ embed face with facenet model """
@@ -13,20 +32,18 @@ class Preprocess:
         embedding = self.model.embeddings(img)
         return embedding[0]
 
+    def embedding_batch(self, imgs):
+        """ embed a list of faces with a single facenet forward pass """
+        return self.model.embeddings(imgs)
+
     def getFace(self, img):
         # img = cv2.imread(img)
         face_list = []
         face_coor = []
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        height, width = gray.shape
-        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        faces = self.detector.detect(img)
         if len(faces)!=0:
-            for (x, y, w, h) in faces:
-                x1 = x
-                y1 = y
-                x2 = x+w
-                y2 = y+h
-                face_image = img[max(0, y1):min(height, y2), max(0, x1):min(width, x2)]  
+            for (x1, y1, x2, y2) in faces:
+                face_image = img[y1:y2, x1:x2]
                 face_image = cv2.resize(face_image, (160, 160))  
                 face_list.append(face_image)
                 face_coor.append((x1,y1,x2,y2))
@@ -34,6 +51,12 @@ class Preprocess:
         else:
             return (None,None)
 
+    def check_quality(self, img, box):
+        """ blur / exposure / pose / spoof pre-filter for a face box returned by getFace, None when disabled """
+        if self.quality is None:
+            return None
+        return self.quality.check(img, box)
+
     def euclid_distance(self, input_embed, db_embed):
         """ calculate euclidan distance between two embeded vector """
         return np.linalg.norm(db_embed-input_embed)
\ No newline at end of file
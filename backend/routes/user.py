@@ -1,28 +1,74 @@
 # routes/user.py
 
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Request, Query
-from pydantic import BaseModel, EmailStr
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, File, UploadFile, Query, Response
+from pydantic import BaseModel, EmailStr, computed_field
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 import os
-import uuid
-from typing import Optional
-from preprocess import Preprocess
+import asyncio
+import io
+from typing import List, Optional
+from model_manager import ModelManager
+from batcher import EmbeddingBatcher
+from executor import InferenceExecutor
+from face_index import FaceIndex
+from vector_codec import encode_vector
+from cache import LRUCache, CachedUser
+from uploads import read_image_upload, decode_upload_image, sniff_image_type
+from storage import image_store, content_digest
+from permissions import ActivePermissionCache, find_active_permission, purge_expired_permissions
+from liveness import quality_stats
+from verification import BURST_MAX_FRAMES, fuse_distances, is_match
+from gallery import add_embedding, load_gallery, centroid_distance, gallery_distance, count_decision, gallery_stats
+from metrics import CallbackMetric, Counter, Histogram, stage
 import cv2
-import pickle
-import numpy as np
 
-from db import get_db
-from models.user import User
-from verify_token import verify_jwt_token
+from db import get_db, get_async_db, SessionLocal
+from models.user import User, UserCentroid
+from verify_token import get_secret_key, require_token, token_stats
 from models.user import Permission
 import qrcode
+import qrcode.image.svg
 
-STATIC_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'static')
+models = ModelManager()
+executor = InferenceExecutor(lambda imgs: models.get().embedding_batch(imgs))
+batcher = EmbeddingBatcher(executor.embed, max_in_flight=executor.model_workers)
+face_index = FaceIndex()
+# invalidation only reaches this process, the TTL bounds how long other workers verify against an old enrollment
+user_cache = LRUCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+                      ttl=float(os.getenv("USER_CACHE_TTL", "30")) or None)
+qr_cache = LRUCache(maxsize=int(os.getenv("QR_CACHE_SIZE", "1024")))
+active_permissions = ActivePermissionCache()
+PERMISSION_RETENTION = timedelta(days=float(os.getenv("PERMISSION_RETENTION_DAYS", "30")))
 
-prep = Preprocess()
+face_not_found = Counter("face_not_found_total", "Uploads in which no face was detected", ("route",))
+verify_decisions = Counter("face_verify_decisions_total", "Verification outcomes against VERIFY_THRESHOLD",
+                           ("route", "result"))
+verify_distance = Histogram("face_verify_distance", "Distance between the probe and the enrolled user", ("route",),
+                            buckets=(0.2, 0.4, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.4, 1.6, 2.0))
+
+# numbers the pipeline components already keep, read when /metrics is scraped
+CallbackMetric("model_ready", "1 once the face model is loaded and warm", lambda: int(models.ready))
+CallbackMetric("embedding_queue_depth", "Faces waiting for the embedding batcher", lambda: batcher.stats()["queue_depth"])
+CallbackMetric("embedding_batches_total", "Batched model calls made by the embedding batcher",
+               lambda: batcher.stats()["batches"], type="counter")
+CallbackMetric("inference_in_flight", "Requests holding an inference slot", lambda: executor.stats()["in_flight"])
+CallbackMetric("inference_rejected_total", "Requests turned away because the inference queue was full",
+               lambda: executor.stats()["rejected"], type="counter")
+CallbackMetric("face_quality_checks_total", "Quality gate outcomes by rejection reason",
+               lambda: {k: v for k, v in quality_stats().items() if k != "checked"}, type="counter", labelname="result")
+CallbackMetric("face_gallery_decisions_total", "Verifications decided by the centroid or by the full gallery",
+               gallery_stats, type="counter", labelname="source")
+CallbackMetric("user_cache_requests_total", "Verification user cache lookups",
+               lambda: {"hit": user_cache.stats()["hits"], "miss": user_cache.stats()["misses"]},
+               type="counter", labelname="result")
+CallbackMetric("auth_tokens_total", "Authorization token checks by outcome",
+               lambda: {k: v for k, v in token_stats().items() if isinstance(v, int)}, type="counter", labelname="result")
 
 user_router = APIRouter()
 
@@ -42,6 +88,11 @@ class UserResponse(BaseModel):
     email: EmailStr
     imageurl: Optional[str] = None
 
+    @computed_field
+    @property
+    def thumbnailurl(self) -> Optional[str]:
+        return image_store.variant_url(self.imageurl, "thumb")
+
     class Config:
         from_attributes = True 
 
@@ -71,8 +122,15 @@ class PermissionAssign(BaseModel):
     permission_id: int
     user_id: int
 
+def save_enrollment_images(digest: str, extension: str, contents: bytes, img, face_image=None):
+    """ write the upload and its variants to the image store, runs as a background task """
+    image_store.save(digest, extension, contents, img=img, face=face_image)
+
+def encode_image(img, extension: str) -> bytes:
+    return cv2.imencode(extension, img)[1].tobytes()
+
 def create_jwt_token(user_id: int, username: str, exp: datetime = None) -> str:
-    secret_key = os.getenv("SECRET_KEY")
+    secret_key = get_secret_key()
     if not secret_key:
         raise ValueError("SECRET_KEY environment variable is not set")
     
@@ -116,74 +174,236 @@ def login_user(user: UserLogin, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @user_router.post("/user/photo", response_model=UserResponse)
-async def update_profile_photo(request: Request, image: UploadFile = File(...), db: Session = Depends(get_db)):
+async def update_profile_photo(background_tasks: BackgroundTasks, image: UploadFile = File(...), decoded_token: dict = Depends(require_token), db: Session = Depends(get_db)):
     try:
-        decoded_token = verify_jwt_token(request.headers.get("authorization"))
-        if decoded_token == None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        db_user = db.query(User).filter(User.id == decoded_token["id"]).first()
-        
-        file_extension = os.path.splitext(image.filename)[-1]  # Extract the file extension
-        filename = str(uuid.uuid4()) +file_extension
+        with stage("db"):
+            db_user = db.query(User).filter(User.id == decoded_token["id"]).first()
         
-        filepath = os.path.join("static", filename)
-        
-        with open(filepath, "wb") as f:
-            contents = await image.read()
-            f.write(contents)
-            
-        face, coor = prep.getFace(cv2.imread(filepath))
-        
-        if face != None:
-            (x1, y1, x2, y2) =coor[0]
-            img = cv2.imread(filepath)
-            cropped_image = img[y1:y2, x1:x2]
-            data_serialized = pickle.dumps(prep.embedding(cropped_image))
-            db_user.vector = data_serialized            
-            crop_name = f"cropped_{filename}.jpg"
-            crop_path = os.path.join(STATIC_FOLDER, crop_name)
-            cv2.imwrite(crop_path, cropped_image)
-
-
-        url = f"/static/{filename}"
-        db_user.imageurl = url
-        db.commit()
+        vector = None
+        face_image = None
+        prep = models.get()
+        async with executor.slot():
+            with stage("upload"):
+                contents = await read_image_upload(image)
+            _, file_extension = sniff_image_type(contents)
+            with stage("decode"):
+                img, resized = await executor.run(decode_upload_image, contents)
+
+            with stage("detect"):
+                face, coor = await executor.run(prep.getFace, img)
+            if face is None:
+                face_not_found.inc(route="/user/photo")
+            else:
+                face_image = face[0]
+                with stage("quality"):
+                    quality = await executor.run(prep.check_quality, img, coor[0])
+                with stage("embedding"):
+                    vector = await batcher.embed(face_image)
+                # every enrollment joins the gallery, User.vector keeps the latest one for the identify index
+                add_embedding(db, db_user.id, vector, quality.score if quality is not None else 1.0,
+                              previous=db_user.vector)
+                db_user.vector = encode_vector(vector)
+
+        if resized:
+            # the downscaled image is what gets stored, so its bytes are what the name and ETag must hash
+            contents = await executor.run(encode_image, img, file_extension)
+        # the url only depends on the content hash, so it is known before the files are written
+        digest = content_digest(contents)
+        background_tasks.add_task(save_enrollment_images, digest, file_extension, contents, img, face_image)
+
+        db_user.imageurl = image_store.url(digest, file_extension)
+        with stage("db"):
+            db.commit()
+        user_cache.invalidate(db_user.id)
+        if vector is not None and face_index.loaded:
+            face_index.add(db_user.id, vector)
         return db_user
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@user_router.post("/user/photo/test")
-async def update_profile_photo_test(request: Request, image: UploadFile = File(...), db: Session = Depends(get_db)):
-    try:
-        decoded_token = verify_jwt_token(request.headers.get("authorization"))
-        if decoded_token is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        db_user = db.query(User).filter(User.id == decoded_token["id"]).first()
+async def load_cached_user(db: AsyncSession, user_id: int) -> CachedUser:
+    cached_user = user_cache.get(user_id)
+    if cached_user is None:
+        result = await db.execute(select(User).where(User.id == user_id))
+        db_user = result.scalar_one_or_none()
         if db_user is None:
             raise HTTPException(status_code=404, detail="User not found")
+        centroid = await db.get(UserCentroid, user_id)
+        cached_user = CachedUser.from_user(db_user, centroid)
+        user_cache.set(cached_user.id, cached_user)
+    return cached_user
+
+async def user_distances(db: AsyncSession, prep, cached_user: CachedUser, vectors) -> list:
+    """ distance of each probe to the enrolled user, from the centroid when that already decides the
+    outcome and from the closest gallery embedding when it is borderline """
+    if cached_user.centroid is None:
+        return [prep.euclid_distance(cached_user.vector, vector) for vector in vectors]
+
+    distances = []
+    gallery = None
+    for vector in vectors:
+        distance, borderline = centroid_distance(cached_user.centroid, cached_user.radius, vector)
+        if borderline:
+            if gallery is None:
+                gallery = await load_gallery(db, cached_user.id)
+            distance = gallery_distance(gallery, vector)
+        count_decision("gallery" if borderline else "centroid")
+        distances.append(distance)
+    return distances
+
+async def read_probe(prep, upload: UploadFile, route: str):
+    """ read, decode, detect and quality check a single probe image, returns (faces, image, boxes) """
+    with stage("upload"):
+        contents = await read_image_upload(upload)
+    with stage("decode"):
+        image, _ = await executor.run(decode_upload_image, contents)
+    with stage("detect"):
+        face, coor = await executor.run(prep.getFace, image)
+
+    if face is None:
+        face_not_found.inc(route=route)
+        raise HTTPException(status_code=400, detail="Face not found")
+
+    # reject blurry, badly lit or spoofed probes before paying for the embedding
+    with stage("quality"):
+        quality = await executor.run(prep.check_quality, image, coor[0])
+    if quality is not None and not quality.ok:
+        raise HTTPException(status_code=400, detail=f"Face rejected: {quality.reason}")
+    return face, image, coor
+
+def record_verification(route: str, distance: float) -> bool:
+    matched = is_match(distance)
+    verify_distance.observe(distance, route=route)
+    verify_decisions.inc(route=route, result="match" if matched else "no_match")
+    return matched
+
+def prepare_probe(prep, contents: bytes):
+    """ decode, detect and quality check one burst frame, returns (face crop, quality, reject reason) """
+    img, _ = decode_upload_image(contents)
+    face, coor = prep.getFace(img)
+    if face is None:
+        return None, None, "face_not_found"
+    quality = prep.check_quality(img, coor[0])
+    if quality is not None and not quality.ok:
+        return None, quality, quality.reason
+    return face[0], quality, None
+
+@user_router.post("/user/photo/test")
+async def update_profile_photo_test(image: UploadFile = File(...), decoded_token: dict = Depends(require_token), db: AsyncSession = Depends(get_async_db)):
+    try:
+        with stage("db"):
+            cached_user = await load_cached_user(db, decoded_token["id"])
+
+        prep = models.get()
+        async with executor.slot():
+            face, image, coor = await read_probe(prep, image, "/user/photo/test")
+
+            with stage("embedding"):
+                vector = await batcher.embed(face[0])
         
-        contents = await image.read()
-        np_array = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-        
-        face, coor = prep.getFace(image)
-                
-        if face is None:
-            raise HTTPException(status_code=400, detail="Face not found")
-        
-        (x1, y1, x2, y2) = coor[0]
-        cropped_image = image[y1:y2, x1:x2]
-        vector = prep.embedding(cropped_image)
-        
-        if db_user.vector is None:
+        if cached_user.vector is None:
             raise HTTPException(status_code=400, detail="User vector not found")
         
-        sim = prep.euclid_distance(pickle.loads(db_user.vector), vector)
-        if 0 < sim < 1:
-            return {"issuccess": True}
-        return {"issuccess": False}
+        with stage("distance"):
+            sim, = await user_distances(db, prep, cached_user, [vector])
+        return {"issuccess": record_verification("/user/photo/test", sim)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@user_router.post("/user/photo/burst")
+async def verify_photo_burst(images: List[UploadFile] = File(...), decoded_token: dict = Depends(require_token), db: AsyncSession = Depends(get_async_db)):
+    """ verify several frames of one person in a single request and a single batched model call """
+    try:
+        if len(images) > BURST_MAX_FRAMES:
+            raise HTTPException(status_code=400, detail=f"At most {BURST_MAX_FRAMES} frames per burst")
+
+        with stage("db"):
+            cached_user = await load_cached_user(db, decoded_token["id"])
+        if cached_user.vector is None:
+            raise HTTPException(status_code=400, detail="User vector not found")
+
+        prep = models.get()
+        async with executor.slot():
+            with stage("upload"):
+                contents = [await read_image_upload(image) for image in images]
+            # decode, detect and quality check run together per frame
+            with stage("prepare"):
+                frames = await asyncio.gather(*(executor.run(prepare_probe, prep, c) for c in contents))
+
+            rejected = {}
+            for _, _, reason in frames:
+                if reason is not None:
+                    rejected[reason] = rejected.get(reason, 0) + 1
+            if "face_not_found" in rejected:
+                face_not_found.inc(rejected["face_not_found"], route="/user/photo/burst")
+            usable = [(crop, quality) for crop, quality, _ in frames if crop is not None]
+            if not usable:
+                raise HTTPException(status_code=400, detail=f"No usable face in burst: {', '.join(sorted(rejected))}")
+
+            with stage("embedding"):
+                vectors = await executor.run(executor.embed, [crop for crop, _ in usable])
+
+        with stage("distance"):
+            distances = await user_distances(db, prep, cached_user, vectors)
+        weights = [quality.score if quality is not None else 1.0 for _, quality in usable]
+        distance = fuse_distances(distances, weights)
+        return {"issuccess": record_verification("/user/photo/burst", distance), "distance": distance, "frames": len(images),
+                "used": len(usable), "rejected": rejected}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@user_router.post("/user/identify")
+async def identify_user(image: UploadFile = File(...), k: int = Query(5, ge=1, le=50), decoded_token: dict = Depends(require_token), db: Session = Depends(get_db)):
+    try:
+        with stage("db"):
+            # the full table read never runs on the event loop; once loaded, a stale index keeps
+            # answering while it is rebuilt in the background
+            if not face_index.loaded:
+                await run_in_threadpool(face_index.ensure_loaded, db)
+            elif face_index.stale():
+                face_index.refresh_in_background(SessionLocal)
+
+        prep = models.get()
+        async with executor.slot():
+            face, image, coor = await read_probe(prep, image, "/user/identify")
+
+            with stage("embedding"):
+                vector = await batcher.embed(face[0])
+
+        with stage("distance"):
+            # only residents the probe actually matches, never the nearest strangers
+            matches = [(user_id, dist) for user_id, dist in face_index.search(vector, k) if is_match(dist)]
+        with stage("db"):
+            rows = await run_in_threadpool(
+                lambda: db.query(User).filter(User.id.in_([user_id for user_id, _ in matches])).all())
+            users = {u.id: u for u in rows}
+        return {"matches": [
+            {"id": user_id, "fullname": users[user_id].fullname, "distance": dist, "issuccess": is_match(dist)}
+            for user_id, dist in matches if user_id in users
+        ]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@user_router.get("/ready")
+def get_ready():
+    status = models.status()
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+@user_router.get("/user/photo/stats")
+def get_photo_stats():
+    return {"batcher": batcher.stats(), "executor": executor.stats(), "face_index": {"size": len(face_index)},
+            "user_cache": user_cache.stats(), "auth": token_stats(), "quality": quality_stats(),
+            "gallery": gallery_stats()}
     
 @user_router.get("/user/getuser", response_model=UserResponse)
 async def get_user(mail: str | None = None, db: Session = Depends(get_db)):
@@ -195,42 +415,124 @@ async def get_user(mail: str | None = None, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def new_permission_entry(permission: PermissionCreate, assigned_by_id: int) -> Permission:
+    return Permission(
+        assigned_by_id=assigned_by_id,
+        user_id=permission.user_id,
+        apartment_id=permission.apartment_id,
+        start_date=permission.start_date,
+        end_date=permission.end_date,
+    )
+
+def qr_url(permission_id: int) -> str:
+    # the QR image is rendered on first request instead of when the permission is created
+    return f"/permission/{permission_id}/qr"
+
+QR_FORMATS = ("png", "svg", "token")
+
+def render_qr(token: str, format: str):
+    """ render a pass token as (bytes, media type) """
+    if format == "token":
+        return token.encode("utf-8"), "text/plain"
+    if format == "svg":
+        img = qrcode.make(token, image_factory=qrcode.image.svg.SvgPathImage)
+        media_type = "image/svg+xml"
+    else:
+        img = qrcode.make(token)
+        media_type = "image/png"
+    buffer = io.BytesIO()
+    img.save(buffer)
+    return buffer.getvalue(), media_type
+
 @user_router.post("/user/permission/create", response_model=PermissionResponse)
 def create_permission(permission: PermissionCreate, db: Session = Depends(get_db)):   
     try:
         assigned_by_id = 1  # This should be dynamically determined based on the logged-in resident
         
-        jwt = create_jwt_token(permission.user_id, "", permission.end_date)
-        
-        img = qrcode.make(jwt)
-        
-        filename =  str(uuid.uuid4()) + ".png"
-        
-        filepath = os.path.join(STATIC_FOLDER, filename)
-        
-        img.save(filepath)
-        
-        new_permission = Permission(
-            assigned_by_id=assigned_by_id,
-            user_id=permission.user_id,
-            apartment_id=permission.apartment_id,
-            start_date=permission.start_date,
-            end_date=permission.end_date,
-            qr_image_url = f"/static/{filename}"
-        )
+        new_permission = new_permission_entry(permission, assigned_by_id)
         db.add(new_permission)
+        db.flush()
+        new_permission.qr_image_url = qr_url(new_permission.id)
         db.commit()
         db.refresh(new_permission)
+        active_permissions.add(new_permission)
         return new_permission
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+@user_router.post("/user/permission/bulk", response_model=List[PermissionResponse])
+def create_permissions_bulk(permissions: List[PermissionCreate], db: Session = Depends(get_db)):
+    """ issue many passes in one transaction, e.g. for an event """
+    try:
+        assigned_by_id = 1  # This should be dynamically determined based on the logged-in resident
+
+        new_permissions = [new_permission_entry(permission, assigned_by_id) for permission in permissions]
+        db.add_all(new_permissions)
+        db.flush()
+        for new_permission in new_permissions:
+            new_permission.qr_image_url = qr_url(new_permission.id)
+        db.commit()
+        for new_permission in new_permissions:
+            active_permissions.add(new_permission)
+        return new_permissions
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+def to_utc_naive(at: Optional[datetime]) -> Optional[datetime]:
+    # permission dates are stored as naive UTC
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+@user_router.get("/permission/check")
+def check_permission(user_id: int, apartment_id: int, at: Optional[datetime] = None, decoded_token: dict = Depends(require_token), db: Session = Depends(get_db)):
+    """ gate check: is there a permission for this user and apartment at time at (default now).
+    The gate sends the pass token read from the QR, so callers can only check their own passes. """
+    if user_id != decoded_token["id"]:
+        raise HTTPException(status_code=403, detail="Can only check your own permissions")
+    at = to_utc_naive(at) or datetime.utcnow()
+    active_permissions.ensure_loaded(db)
+    if active_permissions.covers(at):
+        permission_id = active_permissions.lookup(user_id, apartment_id, at)
+    else:
+        permission_id = find_active_permission(db, user_id, apartment_id, at)
+    return {"active": permission_id is not None, "permission_id": permission_id}
+
+def run_permission_purge() -> int:
+    """ periodic job: delete long expired passes and drop ended ones from the gate cache """
+    db = SessionLocal()
+    try:
+        deleted = purge_expired_permissions(db, PERMISSION_RETENTION)
+    finally:
+        db.close()
+    active_permissions.purge()
+    return deleted
+
+def holds_permission(permission: Permission, user_id: int) -> bool:
+    """ the pass holder, or the resident who granted it """
+    if permission.user_id == user_id:
+        return True
+    return permission.assigned_by is not None and permission.assigned_by.user_id == user_id
+
+@user_router.get("/permission/{permission_id}/qr")
+def get_permission_qr(permission_id: int, format: str = Query("png", pattern="^(png|svg|token)$"), decoded_token: dict = Depends(require_token), db: Session = Depends(get_db)):
+    # the QR carries a bearer token for the pass holder, so only they and the granter may fetch it
+    permission = db.query(Permission).filter(Permission.id == permission_id).first()
+    if permission is None or not holds_permission(permission, decoded_token["id"]):
+        raise HTTPException(status_code=404, detail="Permission not found")
+    cache_key = (permission_id, format)
+    cached = qr_cache.get(cache_key)
+    if cached is None:
+        token = create_jwt_token(permission.user_id, "", permission.end_date)
+        cached = render_qr(token, format)
+        qr_cache.set(cache_key, cached)
+    content, media_type = cached
+    return Response(content=content, media_type=media_type, headers={"Cache-Control": "private, max-age=3600"})
+
 @user_router.get("/permission")
-def get_permission(request: Request, db: Session = Depends(get_db)):
+def get_permission(decoded_token: dict = Depends(require_token), db: Session = Depends(get_db)):
     try:
-        decoded_token = verify_jwt_token(request.headers.get("authorization"))
-        if decoded_token == None:
-            raise HTTPException(status_code=401, detail="Invalid token")
         permissions = db.query(Permission).filter(Permission.user_id == decoded_token["id"]).all()
         return permissions
     except Exception as e:
@@ -244,6 +546,10 @@ def assign_permission(permission: PermissionAssign, db: Session = Depends(get_db
             raise HTTPException(status_code=404, detail="Permission not found")
         permission_entry.user_id = permission.user_id
         db.commit()
+        # the pass token embeds the user id, drop QR codes rendered for the previous holder
+        for format in QR_FORMATS:
+            qr_cache.invalidate((permission_entry.id, format))
+        active_permissions.add(permission_entry)
         db.refresh(permission_entry)
         return permission_entry
     except Exception as e:
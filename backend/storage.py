@@ -0,0 +1,114 @@
+# storage.py
+# Content addressed image store under static/: files are named by their sha256 and sharded as
+# static/ab/cd/<sha256><suffix>, so re-uploads of the same photo share one file.
+
+import hashlib
+import os
+import re
+import tempfile
+
+import cv2
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+
+from preprocess import decode_image
+
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+FACE_SIZE = 160
+
+VARIANTS = ("thumb", "face")
+CONTENT_NAME = re.compile(r"^([0-9a-f]{64})(?:_(thumb|face))?\.[a-z]+$")
+
+
+def content_digest(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+class ImageStore:
+    def __init__(self, root: str = "static", url_prefix: str = "/static"):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def relative_path(self, digest: str, extension: str, variant: str = None) -> str:
+        suffix = f"_{variant}" if variant else ""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}{extension}"
+
+    def path(self, digest: str, extension: str, variant: str = None) -> str:
+        return os.path.join(self.root, self.relative_path(digest, extension, variant))
+
+    def url(self, digest: str, extension: str, variant: str = None) -> str:
+        return f"{self.url_prefix}/{self.relative_path(digest, extension, variant)}"
+
+    def variant_urls(self, digest: str) -> dict:
+        return {variant: self.url(digest, ".jpg", variant) for variant in VARIANTS}
+
+    def variant_url(self, url: str, variant: str):
+        """ url of a size variant for a stored original, None for files saved before the store existed """
+        if not url or not url.startswith(self.url_prefix + "/"):
+            return None
+        match = CONTENT_NAME.match(url.rsplit("/", 1)[-1])
+        if match is None or match.group(2):
+            return None
+        return self.url(match.group(1), ".jpg", variant)
+
+    def _write(self, path: str, contents: bytes):
+        """ write atomically so a concurrent reader never sees half a file """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+
+    def _write_image(self, path: str, img):
+        if not os.path.exists(path):
+            self._write(path, cv2.imencode(os.path.splitext(path)[1], img)[1].tobytes())
+
+    def save(self, digest: str, extension: str, contents: bytes, img=None, face=None):
+        """ store an original and its variants once; existing files are left untouched """
+        path = self.path(digest, extension)
+        if not os.path.exists(path):
+            self._write(path, contents)
+        self.save_variants(digest, img if img is not None else decode_image(contents), face)
+
+    def adopt(self, tmp_path: str, digest: str, extension: str):
+        """ move a streamed upload into the store, or drop it if the content is already there """
+        path = self.path(digest, extension)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        self.save_variants(digest, cv2.imread(path))
+
+    def save_variants(self, digest: str, img, face=None):
+        if img is None:
+            return
+        height, width = img.shape[:2]
+        scale = min(1.0, THUMBNAIL_SIZE / max(height, width))
+        thumb = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+        self._write_image(self.path(digest, ".jpg", "thumb"), thumb)
+        if face is not None:
+            if face.shape[:2] != (FACE_SIZE, FACE_SIZE):
+                face = cv2.resize(face, (FACE_SIZE, FACE_SIZE))
+            self._write_image(self.path(digest, ".jpg", "face"), face)
+
+
+class CachedStaticFiles(StaticFiles):
+    """ serves content addressed files with their hash as a strong ETag and a long immutable cache lifetime """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        match = CONTENT_NAME.match(os.path.basename(full_path))
+        if match is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        digest, variant = match.groups()
+        etag = f'"{digest}-{variant}"' if variant else f'"{digest}"'
+        headers = {"etag": etag, "cache-control": "public, max-age=31536000, immutable"}
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return Response(status_code=304, headers={"etag": etag, "cache-control": headers["cache-control"]})
+        return response
+
+
+image_store = ImageStore()
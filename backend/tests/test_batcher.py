@@ -0,0 +1,43 @@
+import threading
+import time
+
+import numpy as np
+
+from batcher import EmbeddingBatcher
+
+
+def test_batches_crops_of_mixed_sizes():
+    batcher = EmbeddingBatcher(lambda imgs: [img.shape for img in imgs], max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(np.zeros((size, size, 3), dtype=np.uint8)) for size in (120, 160, 200)]
+    assert [future.result(timeout=5) for future in futures] == [(160, 160, 3)] * 3
+
+
+def test_runs_up_to_max_in_flight_batches_at_once():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def runner(imgs):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+        return [0] * len(imgs)
+
+    batcher = EmbeddingBatcher(runner, max_batch_size=1, max_wait_ms=0, max_in_flight=3)
+    futures = [batcher.submit(np.zeros((160, 160, 3), dtype=np.uint8)) for _ in range(6)]
+    for future in futures:
+        future.result(timeout=5)
+    assert peak[0] == 3
+    assert batcher.stats()["batches"] == 6
+
+
+def test_runner_errors_reach_every_caller():
+    def runner(imgs):
+        raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(runner, max_batch_size=2, max_wait_ms=20)
+    futures = [batcher.submit(np.zeros((160, 160, 3), dtype=np.uint8)) for _ in range(2)]
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), RuntimeError)
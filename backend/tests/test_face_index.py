@@ -0,0 +1,85 @@
+import threading
+import time
+
+import numpy as np
+
+from face_index import FaceIndex
+
+
+def make_index():
+    index = FaceIndex(dim=4, capacity=2)
+    for user_id in range(4):
+        index.add(user_id, np.eye(4)[user_id])
+    return index
+
+
+def test_search_orders_by_distance():
+    index = make_index()
+    matches = index.search([0.9, 0.1, 0, 0], k=2)
+    assert [user_id for user_id, _ in matches] == [0, 1]
+    assert matches[0][1] < matches[1][1]
+    assert np.isclose(matches[0][1], np.linalg.norm([0.1, 0.1, 0, 0]))
+
+
+def test_add_grows_past_capacity_and_replaces():
+    index = make_index()
+    assert len(index) == 4
+    index.add(2, [0, 0, 0, 1])
+    assert len(index) == 4
+    assert index.search([0, 0, 1, 0], k=1)[0][0] != 2
+
+
+def test_remove_keeps_other_rows():
+    index = make_index()
+    index.remove(1)
+    index.remove(42)
+    assert len(index) == 3
+    assert {user_id for user_id, _ in index.search([1, 1, 1, 1], k=10)} == {0, 2, 3}
+    # the last row was moved into the hole and must still be found by its own vector
+    assert index.search([0, 0, 0, 1], k=1) == [(3, 0.0)]
+
+
+def test_search_empty_index():
+    assert FaceIndex(dim=4).search([1, 0, 0, 0]) == []
+
+
+def test_ensure_loaded_reloads_after_ttl(monkeypatch):
+    loads = []
+    monkeypatch.setattr("face_index.load_all_vectors",
+                        lambda db: loads.append(db) or (np.array([7]), np.eye(4, dtype=np.float32)[:1]))
+    index = FaceIndex(dim=4, ttl=60)
+    index.ensure_loaded("db")
+    index.ensure_loaded("db")
+    assert len(loads) == 1
+    index._loaded_at -= 61
+    index.ensure_loaded("db")
+    assert len(loads) == 2
+    assert index.search([1, 0, 0, 0], k=1) == [(7, 0.0)]
+
+
+def test_refresh_in_background_swaps_in_new_rows(monkeypatch):
+    release = threading.Event()
+
+    def load_all_vectors(db):
+        release.wait(5)
+        return np.array([9]), np.eye(4, dtype=np.float32)[1:2]
+
+    class Session:
+        closed = False
+
+        def close(self):
+            Session.closed = True
+
+    monkeypatch.setattr("face_index.load_all_vectors", load_all_vectors)
+    index = make_index()
+    assert index.refresh_in_background(Session)
+    assert not index.refresh_in_background(Session)
+    # searches keep answering from the old rows until the rebuild is done
+    assert index.search([1, 0, 0, 0], k=1) == [(0, 0.0)]
+    release.set()
+    for _ in range(100):
+        if not index._refreshing:
+            break
+        time.sleep(0.01)
+    assert index.search([0, 1, 0, 0], k=5) == [(9, 0.0)]
+    assert Session.closed
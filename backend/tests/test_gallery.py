@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import gallery
+from gallery import add_embedding, centroid_distance, compute_centroid, gallery_distance
+from vector_codec import decode_vector, encode_vector
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class Row:
+    """ stands in for the UserEmbedding and UserCentroid models, mapping them needs every model of main.py """
+    id = None
+    user_id = None
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class Centroid(Row):
+    pass
+
+
+class FakeSession:
+    """ keeps the gallery rows add_embedding reads and writes in memory """
+
+    def __init__(self):
+        self.embeddings = []
+        self.centroids = {}
+        self._next_id = 1
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return list(self.embeddings)
+
+    def add_all(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        if isinstance(row, Centroid):
+            self.centroids[row.user_id] = row
+        elif row not in self.embeddings:
+            self.embeddings.append(row)
+
+    def flush(self):
+        for row in self.embeddings:
+            if row.id is None:
+                row.id = self._next_id
+                self._next_id += 1
+
+    def delete(self, row):
+        self.embeddings.remove(row)
+
+    def get(self, model, user_id):
+        return self.centroids.get(user_id)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(gallery, "UserEmbedding", Row)
+    monkeypatch.setattr(gallery, "UserCentroid", Centroid)
+    return FakeSession()
+
+
+def test_centroid_radius_covers_every_vector():
+    vectors = [unit(1, 0, 0), unit(1, 1, 0), unit(1, 0, 1)]
+    centroid, radius = compute_centroid(vectors)
+    assert np.isclose(np.linalg.norm(centroid), 1)
+    assert np.isclose(radius, max(np.linalg.norm(v - centroid) for v in vectors))
+
+
+def test_centroid_short_cut_agrees_with_the_gallery():
+    rng = np.random.default_rng(0)
+    gallery = np.stack([unit(*v) for v in rng.normal(size=(4, 8)) + 3])
+    centroid, radius = compute_centroid(gallery)
+    for threshold in (0.3, 0.6, 1.0):
+        for probe in rng.normal(size=(200, 8)) + rng.choice([0, 3]):
+            probe = unit(*probe)
+            distance, borderline = centroid_distance(centroid, radius, probe, threshold)
+            if not borderline:
+                # outside the band the centroid decides like the closest gallery embedding
+                assert (distance < threshold) == (gallery_distance(gallery, probe) < threshold)
+
+
+def test_add_embedding_keeps_the_newest_entry(db, monkeypatch):
+    monkeypatch.setattr(gallery, "GALLERY_SIZE", 3)
+    for quality, vector in ((0.9, unit(1, 0)), (0.8, unit(1, 1)), (0.7, unit(0, 1))):
+        add_embedding(db, 1, vector, quality)
+    entry = add_embedding(db, 1, unit(-1, 1), quality=0.1)
+
+    rows = db.embeddings
+    assert sorted(row.quality for row in rows) == [0.1, 0.8, 0.9]
+    assert entry.count == 3
+    centroid, radius = compute_centroid([decode_vector(row.vector) for row in rows])
+    assert np.allclose(decode_vector(entry.vector), centroid)
+    assert np.isclose(entry.radius, radius)
+
+
+def test_add_embedding_ranks_the_pre_gallery_vector_lowest(db, monkeypatch):
+    monkeypatch.setattr(gallery, "GALLERY_SIZE", 2)
+    add_embedding(db, 1, unit(1, 0), quality=0.5, previous=encode_vector(unit(0, 1)))
+    add_embedding(db, 1, unit(1, 1), quality=0.2)
+    assert sorted(row.quality for row in db.embeddings) == [0.2, 0.5]
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from permissions import ActivePermissionCache
+
+NOW = datetime(2026, 1, 1, 12)
+
+
+def permission(id, user_id, start_hours, end_hours, apartment_id=1):
+    return SimpleNamespace(id=id, user_id=user_id, apartment_id=apartment_id,
+                           start_date=NOW + timedelta(hours=start_hours), end_date=NOW + timedelta(hours=end_hours))
+
+
+class FakeSession:
+    """ answers the one query ActivePermissionCache.load runs """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def query(self, *columns):
+        self.queries += 1
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return list(self.rows)
+
+
+def make_cache(*rows):
+    cache = ActivePermissionCache(ttl=30)
+    cache.load(FakeSession(rows), now=NOW)
+    return cache
+
+
+def test_lookup_matches_user_apartment_and_interval():
+    cache = make_cache(permission(1, 7, -1, 1), permission(2, 7, 2, 4, apartment_id=2))
+    assert cache.lookup(7, 1, NOW) == 1
+    assert cache.lookup(7, 1, NOW + timedelta(hours=2)) is None
+    assert cache.lookup(7, 2, NOW + timedelta(hours=3)) == 2
+    assert cache.lookup(8, 1, NOW) is None
+
+
+def test_covers_only_from_load_time():
+    cache = ActivePermissionCache(ttl=30)
+    assert not cache.covers(NOW)
+    cache.load(FakeSession([]), now=NOW)
+    assert cache.covers(NOW)
+    assert not cache.covers(NOW - timedelta(seconds=1))
+
+
+def test_add_replaces_a_reassigned_permission():
+    cache = make_cache(permission(1, 7, -1, 1))
+    cache.add(permission(1, 8, -1, 1))
+    assert cache.lookup(7, 1, NOW) is None
+    assert cache.lookup(8, 1, NOW) == 1
+    assert len(cache) == 1
+
+
+def test_purge_drops_ended_intervals_and_moves_coverage():
+    cache = make_cache(permission(1, 7, -2, 1), permission(2, 7, -2, 3))
+    later = NOW + timedelta(hours=2)
+    cache.purge(now=later)
+    assert len(cache) == 1
+    assert cache.lookup(7, 1, later) == 2
+    assert not cache.covers(NOW + timedelta(hours=1))
+
+
+def test_ensure_loaded_reloads_after_ttl():
+    db = FakeSession([permission(1, 7, -1, 1)])
+    cache = ActivePermissionCache(ttl=30)
+    cache.ensure_loaded(db)
+    cache.ensure_loaded(db)
+    assert db.queries == 1
+    # a pass written by another worker shows up after the next reload
+    db.rows.append(permission(2, 8, -1, 1))
+    cache._refreshed_at -= 31
+    cache.ensure_loaded(db)
+    assert db.queries == 2
+    assert len(cache) == 2
@@ -0,0 +1,41 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from vector_codec import HEADER, decode_vector, encode_vector, is_encoded
+
+
+def test_float32_round_trip():
+    vector = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+    blob = encode_vector(vector, "float32")
+    assert is_encoded(blob)
+    assert len(blob) == HEADER.size + 512 * 4
+    decoded = decode_vector(blob)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, vector)
+
+
+def test_float16_round_trip_is_widened():
+    vector = np.linspace(-1, 1, 512, dtype=np.float32)
+    blob = encode_vector(vector, "float16")
+    assert len(blob) == HEADER.size + 512 * 2
+    decoded = decode_vector(blob)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vector, atol=1e-3)
+
+
+def test_legacy_pickle_rows_still_decode():
+    vector = np.arange(8, dtype=np.float64)
+    blob = pickle.dumps(vector)
+    assert not is_encoded(blob)
+    decoded = decode_vector(blob)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, vector)
+
+
+def test_unknown_version_is_rejected():
+    blob = bytearray(encode_vector(np.zeros(4), "float32"))
+    blob[2] = 99
+    with pytest.raises(ValueError):
+        decode_vector(bytes(blob))
@@ -0,0 +1,43 @@
+import pytest
+
+from verification import calibrate_threshold, fuse_distances, is_match, weighted_median
+
+
+def test_is_match_is_strict():
+    assert is_match(0.0, threshold=1.0)
+    assert not is_match(1.0, threshold=1.0)
+
+
+def test_weighted_median_follows_the_weights():
+    assert weighted_median([3, 1, 2], [1, 1, 1]) == 2
+    assert weighted_median([0.2, 0.9, 1.4], [1, 5, 1]) == 0.9
+    assert weighted_median([0.2, 0.9, 1.4], [5, 1, 1]) == 0.2
+
+
+def test_fuse_median_ignores_a_single_bad_frame():
+    assert fuse_distances([0.6, 0.7, 1.8], method="median") == 0.7
+
+
+def test_fuse_min_skips_low_quality_frames():
+    # the lucky 0.3 comes from a frame under half the best quality
+    assert fuse_distances([0.3, 0.8, 0.9], weights=[0.2, 1.0, 0.9], method="min") == 0.8
+    assert fuse_distances([0.3, 0.8, 0.9], method="min") == 0.3
+
+
+def test_fuse_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        fuse_distances([0.5], method="mean")
+
+
+def test_calibrate_equal_error_rate_separates_clean_pairs():
+    result = calibrate_threshold([0.3, 0.4, 0.5], [0.9, 1.0, 1.1])
+    assert 0.5 < result["threshold"] <= 0.9
+    assert result["far"] == 0 and result["frr"] == 0
+
+
+def test_calibrate_target_far_bounds_false_accepts():
+    impostor = [0.5 + i / 100 for i in range(100)]
+    result = calibrate_threshold([0.2, 0.4, 0.7], impostor, target_far=0.05)
+    assert result["far"] <= 0.05
+    assert result["threshold"] == pytest.approx(0.55)
+    assert result["frr"] == pytest.approx(1 / 3)
@@ -0,0 +1,168 @@
+# uploads.py
+
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import cv2
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from preprocess import decode_image
+from storage import ImageStore
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024)
+# whole request body, checked before multipart parsing spools anything to disk; bursts carry several images
+MAX_REQUEST_BYTES = int(float(os.getenv("MAX_REQUEST_MB", "100")) * 1024 * 1024)
+# longest image side kept after decoding, 0 keeps the original resolution
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "0"))
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+    (b"BM", "image/bmp", ".bmp"),
+]
+
+
+def sniff_image_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """ detect the image type from its magic bytes, returns (content type, extension) """
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    return None
+
+
+class RequestSizeLimitMiddleware:
+    """ ASGI middleware rejecting bodies over max_bytes with 413: up front from Content-Length, or while the
+    body is being received for chunked requests """
+
+    def __init__(self, app, max_bytes: int = None):
+        self.app = app
+        self.max_bytes = max_bytes or MAX_REQUEST_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body is larger than {self.max_bytes} bytes"
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # raised inside body parsing, FastAPI turns it into the 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _check_declared_size(upload: UploadFile, max_bytes: int):
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload is larger than {max_bytes} bytes")
+
+
+def _check_image(head: bytes) -> Tuple[str, str]:
+    image_type = sniff_image_type(head)
+    if image_type is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type")
+    return image_type
+
+
+async def read_image_upload(upload: UploadFile, max_bytes: int = None) -> bytes:
+    """ read an image upload in fixed size chunks into a buffer bounded by max_bytes """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    _check_declared_size(upload, max_bytes)
+
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if not buffer:
+            _check_image(chunk)
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {max_bytes} bytes")
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return bytes(buffer)
+
+
+def _copy_to_disk(src, dst, max_bytes: int) -> str:
+    """ copy in chunks while hashing, returns the sha256 of what was written """
+    digest = hashlib.sha256()
+    written = 0
+    while True:
+        chunk = src.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        written += len(chunk)
+        if written > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {max_bytes} bytes")
+        digest.update(chunk)
+        dst.write(chunk)
+    return digest.hexdigest()
+
+
+def _store_upload(src, store: ImageStore, extension: str, max_bytes: int) -> str:
+    os.makedirs(store.root, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=store.root, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            digest = _copy_to_disk(src, dst, max_bytes)
+        store.adopt(tmp_path, digest, extension)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return store.url(digest, extension)
+
+
+async def save_image_upload(upload: UploadFile, store: ImageStore, max_bytes: int = None) -> str:
+    """ stream an image upload into the store without holding it in memory, returns its url """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    _check_declared_size(upload, max_bytes)
+
+    head = await upload.read(16)
+    _, extension = _check_image(head)
+    await upload.seek(0)
+
+    return await run_in_threadpool(_store_upload, upload.file, store, extension, max_bytes)
+
+
+def downscale_image(img, max_side: int = None):
+    """ shrink an image so its longest side is at most max_side, returns (image, resized) """
+    max_side = MAX_IMAGE_SIDE if max_side is None else max_side
+    if img is None or not max_side:
+        return img, False
+    height, width = img.shape[:2]
+    if max(height, width) <= max_side:
+        return img, False
+    scale = max_side / max(height, width)
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), True
+
+
+def decode_upload_image(contents: bytes, max_side: int = None):
+    """ decode upload bytes and apply the ingest downscale, returns (image, resized) """
+    img = decode_image(contents)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Invalid image")
+    return downscale_image(img, max_side)
@@ -0,0 +1,106 @@
+# vector_codec.py
+# Compact storage format for face embeddings in User.vector.
+#
+# Layout: b"FV" | version (uint8) | dtype code (uint8) | dim (uint16 LE) | dim little-endian floats
+#
+# python vector_codec.py migrate   -> rewrite legacy pickled rows in the new format
+
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+
+from models.user import User
+
+# core table access, so the migration command works without configuring every ORM mapper
+users = User.__table__
+
+MAGIC = b"FV"
+VERSION = 1
+HEADER = struct.Struct("<2sBBH")
+
+DTYPES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2"),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+
+def default_dtype():
+    return "float16" if os.getenv("VECTOR_DTYPE", "float32") == "float16" else "float32"
+
+
+def encode_vector(vector, dtype: str = None) -> bytes:
+    """ serialize an embedding as a versioned raw little-endian float array """
+    dtype = np.dtype(dtype or default_dtype()).newbyteorder("<")
+    data = np.ascontiguousarray(vector, dtype=dtype).reshape(-1)
+    return HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], data.shape[0]) + data.tobytes()
+
+
+def is_encoded(blob: bytes) -> bool:
+    return blob[:2] == MAGIC
+
+
+def decode_vector(blob: bytes):
+    """ read an embedding without copying; float16 rows are widened to float32 """
+    if not is_encoded(blob):
+        # rows written before the migration are still numpy pickles
+        return np.asarray(pickle.loads(blob), dtype=np.float32)
+    _, version, code, dim = HEADER.unpack_from(blob)
+    if version != VERSION:
+        raise ValueError(f"Unsupported vector format version {version}")
+    vector = np.frombuffer(blob, dtype=DTYPES[code], count=dim, offset=HEADER.size)
+    if vector.dtype != np.float32:
+        vector = vector.astype(np.float32)
+    return vector
+
+
+def load_all_vectors(db):
+    """ fetch every enrolled embedding with one query, returns (ids, float32 matrix) """
+    rows = db.execute(select(users.c.id, users.c.vector).where(users.c.vector.isnot(None))).all()
+    ids = np.fromiter((user_id for user_id, _ in rows), dtype=np.int64, count=len(rows))
+    if not rows:
+        return ids, np.empty((0, 0), dtype=np.float32)
+
+    blobs = [blob for _, blob in rows]
+    first = blobs[0]
+    if all(is_encoded(blob) and blob[:HEADER.size] == first[:HEADER.size] for blob in blobs):
+        # same header everywhere: view all payloads as one array in a single frombuffer call
+        _, _, code, dim = HEADER.unpack_from(first)
+        payload = b"".join(blob[HEADER.size:] for blob in blobs)
+        matrix = np.frombuffer(payload, dtype=DTYPES[code]).reshape(len(blobs), dim)
+        return ids, matrix.astype(np.float32, copy=False)
+
+    return ids, np.vstack([decode_vector(blob) for blob in blobs])
+
+
+def migrate(db, dtype: str = None) -> int:
+    """ rewrite pickled User.vector rows in the raw format, returns the number of rows changed """
+    rows = db.execute(select(users.c.id, users.c.vector).where(users.c.vector.isnot(None))).all()
+    params = [
+        {"user_id": user_id, "vector": encode_vector(decode_vector(blob), dtype)}
+        for user_id, blob in rows if not is_encoded(blob)
+    ]
+    if params:
+        stmt = update(users).where(users.c.id == bindparam("user_id")).values(vector=bindparam("vector"))
+        db.execute(stmt, params)
+    db.commit()
+    return len(params)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("usage: python vector_codec.py migrate [float32|float16]")
+        sys.exit(1)
+
+    from db import SessionLocal
+
+    session = SessionLocal()
+    try:
+        count = migrate(session, sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"Migrated {count} vectors")
+    finally:
+        session.close()
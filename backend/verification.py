@@ -0,0 +1,63 @@
+# verification.py
+
+import os
+
+import numpy as np
+
+# euclidean distance below which two embeddings are the same person. 1.0 is the old hardcoded rule and
+# has not been calibrated; measure it for the deployed backend with facenet_tools.py calibrate
+VERIFY_THRESHOLD = float(os.getenv("VERIFY_THRESHOLD", "1.0"))
+
+# how the per-frame distances of a burst are combined: "median" or "min"
+BURST_FUSION = os.getenv("BURST_FUSION", "median")
+BURST_MAX_FRAMES = int(os.getenv("BURST_MAX_FRAMES", "8"))
+
+
+def is_match(distance: float, threshold: float = None) -> bool:
+    return bool(distance < (VERIFY_THRESHOLD if threshold is None else threshold))
+
+
+def weighted_median(values, weights) -> float:
+    order = np.argsort(values)
+    values = np.asarray(values, dtype=np.float64)[order]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    cumulative = np.cumsum(weights)
+    return float(values[np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def fuse_distances(distances, weights=None, method: str = None) -> float:
+    """ combine the distances of several frames of the same person into one.
+    median: quality weighted median, robust against a single bad frame.
+    min: smallest distance among frames with at least half the best quality, so a sharp frame wins
+    without letting a poor one through on a lucky match. """
+    distances = np.asarray(distances, dtype=np.float64)
+    weights = np.ones_like(distances) if weights is None else np.maximum(np.asarray(weights, dtype=np.float64), 1e-6)
+    method = method or BURST_FUSION
+    if method == "min":
+        return float(distances[weights >= weights.max() / 2].min())
+    if method == "median":
+        return weighted_median(distances, weights)
+    raise ValueError(f"Unknown fusion method {method}")
+
+
+def calibrate_threshold(genuine, impostor, target_far: float = None) -> dict:
+    """ threshold from distances of same person (genuine) and different person (impostor) pairs.
+    With target_far the largest threshold that accepts at most that share of impostors, otherwise the
+    equal error rate point. Returns the threshold with its false accept and false reject rates. """
+    genuine = np.sort(np.asarray(genuine, dtype=np.float64))
+    impostor = np.sort(np.asarray(impostor, dtype=np.float64))
+    if not len(genuine) or not len(impostor):
+        raise ValueError("Calibration needs both genuine and impostor pairs")
+    if target_far is not None:
+        # is_match is strict, so at most k impostors lie below the k-th smallest impostor distance
+        threshold = impostor[min(int(target_far * len(impostor)), len(impostor) - 1)]
+    else:
+        candidates = np.unique(np.concatenate([genuine, impostor]))
+        far = np.searchsorted(impostor, candidates, side="left") / len(impostor)
+        frr = 1 - np.searchsorted(genuine, candidates, side="left") / len(genuine)
+        threshold = candidates[np.argmin(np.abs(far - frr))]
+    return {
+        "threshold": float(threshold),
+        "far": float(np.mean(impostor < threshold)),
+        "frr": float(np.mean(genuine >= threshold)),
+    }
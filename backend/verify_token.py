@@ -1,14 +1,87 @@
 from typing import Optional
-import jwt
 import os
+import threading
+import time
+
+import jwt
+from fastapi import HTTPException, Request
+
+from cache import LRUCache
+
+# validated tokens are kept until they expire or for at most this many seconds
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+token_cache = LRUCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+_secret_key = None
+_stats_lock = threading.Lock()
+_stats = {"verified": 0, "cache_hits": 0, "missing": 0, "expired": 0, "invalid": 0}
+_latency = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+
+def get_secret_key() -> Optional[str]:
+    """ read SECRET_KEY once, after dotenv has been loaded """
+    global _secret_key
+    if _secret_key is None:
+        _secret_key = os.getenv("SECRET_KEY")
+    return _secret_key
+
+
+def _count(name: str, elapsed_ms: float):
+    with _stats_lock:
+        _stats[name] += 1
+        _latency["count"] += 1
+        _latency["total_ms"] += elapsed_ms
+        _latency["max_ms"] = max(_latency["max_ms"], elapsed_ms)
+
 
 def verify_jwt_token(token: str) -> Optional[dict]:
-    secret_key = os.getenv("SECRET_KEY")
+    started = time.perf_counter()
+    if not token:
+        _count("missing", (time.perf_counter() - started) * 1000)
+        return None
+
+    payload = token_cache.get(token)
+    if payload is not None:
+        if payload.get("exp") is None or payload["exp"] > time.time():
+            _count("cache_hits", (time.perf_counter() - started) * 1000)
+            return payload
+        token_cache.invalidate(token)
+
     try:
-        payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-        return payload
+        payload = jwt.decode(token, get_secret_key(), algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         print("Token expired.")
+        _count("expired", (time.perf_counter() - started) * 1000)
+        return None
     except jwt.InvalidTokenError:
         print("Invalid token.")
-    return None
\ No newline at end of file
+        _count("invalid", (time.perf_counter() - started) * 1000)
+        return None
+
+    ttl = TOKEN_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(token, payload, ttl=ttl)
+    _count("verified", (time.perf_counter() - started) * 1000)
+    return payload
+
+
+def require_token(request: Request) -> dict:
+    """ FastAPI dependency returning the decoded Authorization token, 401 if it is missing or invalid """
+    decoded_token = verify_jwt_token(request.headers.get("authorization"))
+    if decoded_token is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return decoded_token
+
+
+def token_stats() -> dict:
+    with _stats_lock:
+        count = _latency["count"]
+        return {
+            **_stats,
+            "avg_ms": _latency["total_ms"] / count if count else 0.0,
+            "max_ms": _latency["max_ms"],
+            "cache": token_cache.stats(),
+        }
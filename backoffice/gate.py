@@ -0,0 +1,158 @@
+import os
+
+import cv2
+
+from tracking import FaceTracker
+
+
+def put_status(img, text):
+    cv2.putText(img, text, (70, 70), cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+
+
+class GateStateMachine:
+    """ QR read -> blink liveness -> backend verification, one frame at a time """
+
+    QR_READ = "qr_read"
+    FACE_DETECTION = "face_detection"
+    AUTH = "auth"
+
+    # response of a verification the backend could not run on the frame (no face, rejected by the quality gate)
+    RETRY = "retry"
+
+    def __init__(self, client, qr_every=None, qr_scale=None, blink_threshold=10, tracking=None, frame_retries=None):
+        self.client = client
+        # QR decoding is the most expensive step, run it on every Nth frame of a downscaled image
+        self.qr_every = qr_every or int(os.getenv("GATE_QR_EVERY", "3"))
+        self.qr_scale = qr_scale or float(os.getenv("GATE_QR_SCALE", "0.5"))
+        self.blink_threshold = blink_threshold
+        # new frames sent after the backend could not use one, before giving up with a denial
+        self.frame_retries = frame_retries if frame_retries is not None else int(os.getenv("GATE_FRAME_RETRIES", "3"))
+        self.retries = 0
+
+        # Initializing the face and eye cascade classifiers from xml files
+        self.face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+        self.eye_cascade = cv2.CascadeClassifier('haarcascade_eye_tree_eyeglasses.xml')
+        # Initialize the QRCode detector
+        self.qr_detector = cv2.QRCodeDetector()
+
+        # follow the face between full detections instead of running the cascade on every frame
+        if tracking is None:
+            tracking = os.getenv("GATE_TRACKING", "1") == "1"
+        self.tracker = FaceTracker(self.face_cascade) if tracking else None
+
+        self.mode = self.QR_READ
+        self.frame_index = 0
+
+        # Data
+        self.decoded_info = None
+        self.blink_count = 0
+        self.img_face = None
+        self.img_wide = None
+
+        # Request state
+        self.req_in_progress = False
+        self.authorized = False
+        self.response = None
+
+    @property
+    def decision(self):
+        """ None while undecided, otherwise "authorized" or "denied" """
+        if self.mode != self.AUTH or self.req_in_progress or self.response is None or self.response == self.RETRY:
+            return None
+        return "authorized" if self.authorized else "denied"
+
+    def _on_auth_result(self, result):
+        self.authorized = bool(result)
+        self.response = self.RETRY if result is None else result
+        self.req_in_progress = False
+
+    def _read_qr(self, gray):
+        small = gray
+        if self.qr_scale < 1:
+            small = cv2.resize(gray, None, fx=self.qr_scale, fy=self.qr_scale, interpolation=cv2.INTER_AREA)
+        decoded_info, _, _ = self.qr_detector.detectAndDecode(small)
+        if not decoded_info and small is not gray:
+            # small or distant codes may only decode at full resolution
+            decoded_info, _, _ = self.qr_detector.detectAndDecode(gray)
+        return decoded_info
+
+    def _detect_face(self, img, gray):
+        if self.tracker is not None:
+            faces = self.tracker.update(gray)
+        else:
+            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5, minSize=(200, 200))
+        annotations = []
+        for (x, y, w, h) in faces:
+            # eyes are only searched inside the (tracked) face box
+            roi_face = gray[y:y + h, x:x + w]
+            eyes = self.eye_cascade.detectMultiScale(roi_face, 1.3, 5, minSize=(50, 50))
+
+            if len(eyes) >= 2:
+                annotations.append(((x, y, w, h), 'EYES OPEN' + str(self.blink_count)))
+            else:
+                self.blink_count += 1
+                annotations.append(((x, y, w, h), 'BLINK COUNT' + str(self.blink_count)))
+
+            if self.mode != self.AUTH and self.blink_count >= self.blink_threshold and len(eyes) >= 2:
+                # copy before anything is drawn on the frame
+                self.img_wide = img.copy()
+                self.img_face = self.img_wide[y:y + h, x:x + w]
+                self.mode = self.AUTH
+
+        for (x, y, w, h), text in annotations:
+            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            put_status(img, text)
+
+    def _retry_frame(self):
+        """ go back to face detection for a new frame of the same person, the blinks already counted """
+        if self.retries >= self.frame_retries:
+            self.response = False
+            return False
+        self.retries += 1
+        self.response = None
+        self.img_face = None
+        self.img_wide = None
+        self.mode = self.FACE_DETECTION
+        return True
+
+    def _auth(self, img):
+        if self.response == self.RETRY and not self.req_in_progress and self._retry_frame():
+            put_status(img, 'RETRY')
+            return
+
+        if not self.req_in_progress and not self.authorized and self.response is None:
+            self.req_in_progress = True
+            self.client.submit(self.decoded_info, self.img_wide, self._on_auth_result)
+            print("Request Sent, waiting for response")
+
+        if self.req_in_progress:
+            put_status(img, 'REQUEST...')
+        elif self.authorized:
+            put_status(img, 'Authorized')
+        else:
+            put_status(img, 'Access Denied')
+
+    def process(self, img):
+        """ run one frame through the state machine, draws the status onto img and returns it """
+        self.frame_index += 1
+        if self.mode == self.AUTH:
+            self._auth(img)
+            return img
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.bilateralFilter(gray, 5, 1, 1)
+
+        if self.mode == self.QR_READ and self.frame_index % self.qr_every == 0:
+            decoded_info = self._read_qr(gray)
+            if decoded_info:
+                self.decoded_info = decoded_info
+                self.mode = self.FACE_DETECTION
+                if self.tracker is not None:
+                    self.tracker.reset()
+
+        if self.mode == self.FACE_DETECTION:
+            self._detect_face(img, gray)
+
+        if self.mode == self.AUTH:
+            self._auth(img)
+        return img
@@ -0,0 +1,108 @@
+import os
+import queue
+import random
+import threading
+import time
+
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+# Requests that are worth retrying: the backend is restarting or overloaded
+RETRY_STATUS = (502, 503, 504)
+# 400 answers about the frame rather than the person, another frame may pass
+RETRY_FRAME_DETAILS = ("Face not found", "Face rejected")
+
+
+class GateClient:
+    """ keep-alive HTTP client for the backend with timeouts, retries and a single worker thread """
+
+    def __init__(self, base_url=None, connect_timeout=3.05, read_timeout=10.0, retries=3, backoff=0.3,
+                 jpeg_quality=None, max_side=None):
+        self.base_url = (base_url or os.getenv("GATE_BACKEND_URL", "http://localhost:8000")).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.jpeg_quality = jpeg_quality or int(os.getenv("GATE_JPEG_QUALITY", "85"))
+        self.max_side = max_side if max_side is not None else int(os.getenv("GATE_MAX_SIDE", "640"))
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        # one pending job at most, the gate only ever verifies one person at a time
+        self._jobs = queue.Queue(maxsize=1)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def encode(self, img):
+        """ JPEG encode in memory, downscaled so the longest side is at most max_side """
+        height, width = img.shape[:2]
+        if self.max_side and max(height, width) > self.max_side:
+            scale = self.max_side / max(height, width)
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("Could not encode image")
+        return encoded.tobytes()
+
+    def _post(self, path, **kwargs):
+        """ POST with bounded retries and jittered exponential backoff """
+        url = self.base_url + path
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def verify(self, token, img):
+        """ send one face image for verification, returns True when the backend accepts it, False when it
+        denies it and None when the frame could not be used and a new one should be sent """
+        if img is None:
+            raise ValueError("img cannot be None")
+        files = {'image': ('face.jpg', self.encode(img), 'image/jpeg')}
+        response = self._post('/user/photo/test', headers={'Authorization': f'{token}'}, files=files)
+        print(f"Response: {response.content}")
+        if response.status_code == 200:
+            return response.json().get("issuccess", False)
+        if response.status_code == 400 and self._detail(response).startswith(RETRY_FRAME_DETAILS):
+            return None
+        return False
+
+    @staticmethod
+    def _detail(response):
+        try:
+            return str(response.json().get("detail", ""))
+        except ValueError:
+            return ""
+
+    def submit(self, token, img, callback):
+        """ queue a verification for the worker thread; callback(result) runs with the verify() result.
+        Returns False if a verification is already pending. """
+        try:
+            self._jobs.put_nowait((token, img, callback))
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            token, img, callback = job
+            try:
+                result = self.verify(token, img)
+            except Exception as e:
+                print(f"Request failed: {e}")
+                result = False
+            callback(result)
+
+    def close(self):
+        self._jobs.put(None)
+        self._worker.join(timeout=self.timeout[0] + self.timeout[1])
+        self.session.close()
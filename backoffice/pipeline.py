@@ -0,0 +1,131 @@
+import threading
+import time
+
+
+class StageStats:
+    """ frames per second and average latency of one pipeline stage """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._count = 0
+        self._latency = 0.0
+        self._started = time.perf_counter()
+
+    def record(self, latency):
+        with self._lock:
+            self._count += 1
+            self._latency += latency
+
+    def snapshot(self, reset=True):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            result = {
+                "fps": self._count / elapsed if elapsed else 0.0,
+                "latency_ms": self._latency / self._count * 1000 if self._count else 0.0,
+                "frames": self._count,
+            }
+            if reset:
+                self._count = 0
+                self._latency = 0.0
+                self._started = time.perf_counter()
+        return result
+
+
+class LatestFrame:
+    """ single slot holding the newest item; older items are overwritten instead of queued """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+
+    def put(self, item):
+        with self._cond:
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, last_seq, timeout=None):
+        """ wait for an item newer than last_seq, returns (seq, item) or (last_seq, None) on timeout """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq != last_seq, timeout):
+                return last_seq, None
+            return self._seq, self._item
+
+
+class GatePipeline:
+    """ capture thread -> processing thread -> display on the caller's thread.
+    Capture always keeps the newest frame, so slow processing skips frames instead of lagging behind. """
+
+    def __init__(self, cap, gate, stats_interval=5.0):
+        self.cap = cap
+        self.gate = gate
+        self.stats_interval = stats_interval
+        self.captured = LatestFrame()
+        self.processed = LatestFrame()
+        self.stats = {name: StageStats(name) for name in ("capture", "process", "display")}
+        self.running = False
+        self._threads = []
+        self._last_report = time.perf_counter()
+
+    def start(self):
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._process_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def _capture_loop(self):
+        while self.running:
+            started = time.perf_counter()
+            ret, img = self.cap.read()
+            if not ret:
+                self.running = False
+                self.captured.put(None)
+                return
+            captured_at = time.perf_counter()
+            self.stats["capture"].record(captured_at - started)
+            self.captured.put((captured_at, img))
+
+    def _process_loop(self):
+        seq = 0
+        while self.running:
+            seq, item = self.captured.get(seq, timeout=0.5)
+            if item is None:
+                continue
+            captured_at, img = item
+            img = self.gate.process(img)
+            # latency from capture to processed frame, including time spent waiting for this stage
+            self.stats["process"].record(time.perf_counter() - captured_at)
+            self.processed.put((captured_at, img))
+
+    def frames(self, timeout=0.5):
+        """ yield processed frames for display until the camera stops """
+        seq = 0
+        while self.running:
+            seq, item = self.processed.get(seq, timeout)
+            if item is None:
+                continue
+            captured_at, img = item
+            yield img
+            self.stats["display"].record(time.perf_counter() - captured_at)
+            self.report()
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.stats_interval:
+            return
+        self._last_report = now
+        parts = []
+        for name, stage in self.stats.items():
+            snap = stage.snapshot()
+            parts.append(f"{name}: {snap['fps']:.1f} fps {snap['latency_ms']:.1f} ms")
+        print(" | ".join(parts))
@@ -0,0 +1,223 @@
+# replay.py
+# Headless gate run over a video file or a folder of frames, writes a JSON report
+# python replay.py input.mp4 [--report replay.json] [--stub accept|deny] [--stub-latency 50]
+# python replay.py frames/ --backend http://localhost:8000 --detect-every 5 --tracker template
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def iter_frames(source):
+    """ frames of a video file, or the images of a folder in name order """
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            img = cv2.imread(os.path.join(source, name))
+            if img is not None:
+                yield img
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Could not open {source}")
+    try:
+        while True:
+            ret, img = cap.read()
+            if not ret:
+                return
+            yield img
+    finally:
+        cap.release()
+
+
+def source_fps(source):
+    if os.path.isdir(source):
+        return None
+    cap = cv2.VideoCapture(source)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps or None
+
+
+class StubBackend:
+    """ local stand-in for /user/photo/test that answers with a fixed decision after a fixed latency """
+
+    def __init__(self, accept=True, latency_ms=0.0):
+        stub = self
+        self.accept = accept
+        self.latency = latency_ms / 1000
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                time.sleep(stub.latency)
+                body = json.dumps({"issuccess": stub.accept}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def summarize(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def replay(gate, frames, fps=None, realtime=False, run_all=False, decision_timeout=15.0):
+    """ push frames through the gate state machine as fast as it can take them (or at fps when realtime)
+    and record what happened to each one """
+    records = []
+    events = {}
+    started = time.perf_counter()
+
+    for index, img in enumerate(frames):
+        frame_started = time.perf_counter()
+        mode = gate.mode
+        gate.process(img)
+        elapsed = (time.perf_counter() - frame_started) * 1000
+        records.append({"frame": index, "mode": mode, "ms": round(elapsed, 3)})
+
+        if gate.mode != mode:
+            events.setdefault(gate.mode, {"frame": index, "ms": round((time.perf_counter() - started) * 1000, 3)})
+        if gate.decision is not None and "decision" not in events:
+            events["decision"] = {"frame": index, "ms": round((time.perf_counter() - started) * 1000, 3)}
+            if not run_all:
+                break
+        if realtime and fps:
+            time.sleep(max(0.0, (index + 1) / fps - (time.perf_counter() - started)))
+
+    # the source may end while the backend request is still in flight
+    deadline = time.perf_counter() + decision_timeout
+    while gate.decision is None and gate.req_in_progress and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    if gate.decision is not None and "decision" not in events:
+        events["decision"] = {"frame": len(records) - 1, "ms": round((time.perf_counter() - started) * 1000, 3)}
+
+    total = time.perf_counter() - started
+    return records, events, total
+
+
+def build_report(source, records, events, total, gate, fps=None):
+    timings = [r["ms"] for r in records]
+    by_mode = {}
+    for r in records:
+        by_mode.setdefault(r["mode"], []).append(r["ms"])
+
+    decision = events.get("decision")
+    report = {
+        "source": source,
+        "frames": len(records),
+        "seconds": round(total, 3),
+        "fps": round(len(records) / total, 2) if total else 0.0,
+        "frame_timings": summarize(timings),
+        "mode_timings": {mode: dict(summarize(values), frames=len(values)) for mode, values in by_mode.items()},
+        "qr_decoded": events.get(gate.FACE_DETECTION),
+        "liveness_passed": events.get(gate.AUTH),
+        "decision": gate.decision,
+        "time_to_decision": decision,
+        "per_frame": records,
+    }
+    if decision and fps:
+        # how long a live camera at the source frame rate would have taken to get here
+        report["time_to_decision"] = dict(decision, video_ms=round(decision["frame"] / fps * 1000, 3))
+    if gate.tracker is not None:
+        report["tracker"] = {
+            "detections": gate.tracker.detections,
+            "tracked": gate.tracker.tracked,
+            "detect_every": gate.tracker.detect_every,
+            "backend": type(gate.tracker.tracker).__name__,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless gate replay")
+    parser.add_argument("source", help="video file or folder of frames")
+    parser.add_argument("--report", default="replay.json")
+    parser.add_argument("--backend", default=None, help="backend url, a local stub is started when omitted")
+    parser.add_argument("--stub", choices=("accept", "deny"), default="accept")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="stub response time in ms")
+    parser.add_argument("--blink-threshold", type=int, default=10)
+    parser.add_argument("--qr-every", type=int, default=None)
+    parser.add_argument("--detect-every", type=int, default=None)
+    parser.add_argument("--tracker", default=None)
+    parser.add_argument("--no-tracking", action="store_true")
+    parser.add_argument("--realtime", action="store_true", help="pace frames at the video frame rate")
+    parser.add_argument("--all", action="store_true", help="keep going after the decision")
+    args = parser.parse_args()
+
+    # gate.py reads these when the state machine is built
+    if args.detect_every:
+        os.environ["GATE_DETECT_EVERY"] = str(args.detect_every)
+    if args.tracker:
+        os.environ["GATE_TRACKER"] = args.tracker
+
+    from gate import GateStateMachine
+    from gate_client import GateClient
+
+    stub = None
+    if args.backend is None:
+        stub = StubBackend(accept=args.stub == "accept", latency_ms=args.stub_latency).start()
+    client = GateClient(base_url=args.backend or stub.url)
+    gate = GateStateMachine(client, qr_every=args.qr_every, blink_threshold=args.blink_threshold,
+                            tracking=not args.no_tracking)
+
+    fps = source_fps(args.source)
+    try:
+        records, events, total = replay(gate, iter_frames(args.source), fps=fps,
+                                        realtime=args.realtime, run_all=args.all)
+    finally:
+        client.close()
+        if stub is not None:
+            stub.stop()
+
+    report = build_report(args.source, records, events, total, gate, fps=fps)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    timings = report["frame_timings"]
+    print(f"{report['frames']} frames in {report['seconds']}s ({report['fps']} fps), "
+          f"mean {timings.get('mean_ms', 0)} ms p95 {timings.get('p95_ms', 0)} ms")
+    print(f"decision: {report['decision']} at {report['time_to_decision']}")
+    print(f"report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
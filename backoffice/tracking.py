@@ -0,0 +1,119 @@
+import os
+
+import cv2
+
+
+def _opencv_tracker_factory(name):
+    """ CSRT/KCF live in opencv-contrib (cv2 or cv2.legacy); None when this build does not have them """
+    attr = f"Tracker{name.upper()}_create"
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        if module is not None and hasattr(module, attr):
+            return getattr(module, attr)
+    return None
+
+
+class TemplateTracker:
+    """ follows a face by template matching inside an expanded search window around the last box """
+
+    def __init__(self, margin=0.5):
+        self.margin = margin
+        self.template = None
+        self.box = None
+
+    def init(self, gray, box):
+        x, y, w, h = box
+        self.template = gray[y:y + h, x:x + w].copy()
+        self.box = box
+
+    def update(self, gray):
+        """ returns (box, confidence) """
+        x, y, w, h = self.box
+        height, width = gray.shape[:2]
+        dx, dy = int(w * self.margin), int(h * self.margin)
+        x1, y1 = max(0, x - dx), max(0, y - dy)
+        x2, y2 = min(width, x + w + dx), min(height, y + h + dy)
+        window = gray[y1:y2, x1:x2]
+        if window.shape[0] < h or window.shape[1] < w:
+            return self.box, 0.0
+
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, confidence, _, (mx, my) = cv2.minMaxLoc(result)
+        self.box = (x1 + mx, y1 + my, w, h)
+        self.template = gray[self.box[1]:self.box[1] + h, self.box[0]:self.box[0] + w].copy()
+        return self.box, confidence
+
+
+class OpenCVTracker:
+    """ wraps a cv2 tracker (CSRT, KCF) behind the TemplateTracker interface """
+
+    def __init__(self, factory, min_size=(0, 0)):
+        self.factory = factory
+        self.min_size = min_size
+        self.tracker = None
+
+    def init(self, gray, box):
+        self.tracker = self.factory()
+        self.tracker.init(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), tuple(int(v) for v in box))
+
+    def update(self, gray):
+        ok, box = self.tracker.update(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        # the cv2 trackers follow a face past the frame edge, negative offsets would wrap around when slicing
+        x, y, w, h = (int(v) for v in box)
+        height, width = gray.shape[:2]
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(width, x + w), min(height, y + h)
+        box = (x1, y1, max(0, x2 - x1), max(0, y2 - y1))
+        if not ok or box[2] < self.min_size[0] or box[3] < self.min_size[1]:
+            return box, 0.0
+        return box, 1.0
+
+
+class FaceTracker:
+    """ detect-then-track: full cascade detection every detect_every frames or when tracking confidence
+    drops, a lightweight tracker in between """
+
+    def __init__(self, face_cascade, detect_every=None, tracker=None, min_confidence=0.6,
+                 scale_factor=1.3, min_neighbors=5, min_size=(200, 200)):
+        self.face_cascade = face_cascade
+        self.detect_every = detect_every or int(os.getenv("GATE_DETECT_EVERY", "5"))
+        self.min_confidence = min_confidence
+        self.detect_args = (scale_factor, min_neighbors)
+        self.min_size = min_size
+
+        name = tracker or os.getenv("GATE_TRACKER", "template")
+        factory = _opencv_tracker_factory(name) if name != "template" else None
+        self.tracker = OpenCVTracker(factory, min_size) if factory else TemplateTracker()
+
+        self.box = None
+        self.frames_since_detect = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def reset(self):
+        self.box = None
+        self.frames_since_detect = 0
+
+    def _detect(self, gray):
+        self.detections += 1
+        self.frames_since_detect = 0
+        faces = self.face_cascade.detectMultiScale(gray, *self.detect_args, minSize=self.min_size)
+        if len(faces) == 0:
+            self.box = None
+            return []
+        # the gate serves one person at a time, follow the largest face
+        self.box = tuple(int(v) for v in max(faces, key=lambda f: f[2] * f[3]))
+        self.tracker.init(gray, self.box)
+        return [self.box]
+
+    def update(self, gray):
+        """ returns a list with at most one (x, y, w, h) face box for this frame """
+        self.frames_since_detect += 1
+        if self.box is None or self.frames_since_detect >= self.detect_every:
+            return self._detect(gray)
+
+        box, confidence = self.tracker.update(gray)
+        if confidence < self.min_confidence:
+            return self._detect(gray)
+        self.tracked += 1
+        self.box = box
+        return [box]
@@ -159,7 +159,10 @@ class _CreatePermissionScreenState extends State<CreatePermissionScreen> {
         builder: (BuildContext context) {
           return AlertDialog(
             title: Text("Kayıt Başarılı"),
-            content: Image.network('$ip_adres' + jsonDecode(response.body)['qr_image_url']),
+            content: Image.network(
+              '$ip_adres' + jsonDecode(response.body)['qr_image_url'],
+              headers: {'Authorization': token},
+            ),
             actions: [
               TextButton(
                 onPressed: () {
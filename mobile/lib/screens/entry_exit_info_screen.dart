@@ -1,6 +1,7 @@
 import 'package:flutter/material.dart';
 import '../services/permissions_service.dart';
 import '../services/ip_adress.dart';
+import '../services/token_manager.dart';
 
 class EntryExitInfoScreen extends StatelessWidget {
   @override
@@ -66,8 +67,9 @@ class EntryExitInfoScreen extends StatelessWidget {
     );
   }
 
-  void showPermissionDialog(BuildContext context, Permission permission) {
+  Future<void> showPermissionDialog(BuildContext context, Permission permission) async {
     String imageUrl = '$ipAdres${permission.qrImageUrl}';
+    String? token = await TokenManager().getToken();
     print('QR Image URL: $imageUrl'); // Debugging line
 
     showDialog(
@@ -84,6 +86,7 @@ class EntryExitInfoScreen extends StatelessWidget {
                 Text('Bitiş Tarih: ${permission.endDate}'),
                 Image.network(
                   imageUrl,
+                  headers: {'Authorization': token ?? ''},
                   errorBuilder: (BuildContext context, Object exception, StackTrace? stackTrace) {
                     print('Failed to load image: $exception'); // Debugging line
                     return Text('Failed to load QR image');